@@ -0,0 +1,105 @@
+import os
+import random
+import time
+import Objects
+import Logic
+import Service
+import Simulation
+import TileMap
+
+
+def build_engine(object_count, size=256):
+    game_map = TileMap.TileMap.from_strings(
+        ['0' * size] + ['0' + ' ' * (size - 2) + '0'] * (size - 2) + ['0' * size],
+        Service.palette)
+
+    engine = Logic.GameEngine()
+    engine.load_map(game_map)
+    engine.add_hero(Objects.Hero({"strength": 20, "endurance": 20,
+                                  "intelligence": 5, "luck": 5}, ["hero"]))
+    # Первая строка остаётся свободной для героя
+    cells = ((x, y) for y in range(2, size - 1) for x in range(1, size - 1))
+    for _, coord in zip(range(object_count), cells):
+        engine.add_object(Objects.Ally(["chest"], lambda e, h: None, coord))
+    return engine
+
+
+def bench_moves(object_counts=(10, 100, 1000, 10000), steps=100000):
+    print(f"{'objects':>8} {'moves/s':>12}")
+    for count in object_counts:
+        engine = build_engine(count)
+        moves = [engine.move_right] * 100 + [engine.move_left] * 100
+        start = time.perf_counter()
+        for i in range(steps):
+            moves[i % len(moves)]()
+        elapsed = time.perf_counter() - start
+        print(f"{count:>8} {steps / elapsed:>12.0f}")
+
+
+def init_display(screen_dim=(800, 600)):
+    # Без окна бенчмарки рисуют через dummy-драйвер SDL
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    pygame.init()
+    return pygame.display.set_mode(screen_dim)
+
+
+def bench_render(frames=500):
+    import pygame
+    import ScreenEngine as SE
+    display = init_display()
+    engine = Simulation.create_engine()
+    engine.show_help = True
+    drawer = SE.ProgressBar((640, 120), (640, 0),
+                            SE.InfoWindow((160, 600), (50, 50),
+                                          SE.HelpWindow((700, 500), pygame.SRCALPHA, (0, 0),
+                                                        SE.ScreenHandle((0, 0)))))
+    drawer.connect_engine(engine)
+    for i in range(30):
+        engine.notify(f"Message {i}")
+    engine.events.dispatch()
+    moves = [engine.move_right, engine.move_left]
+    start = time.perf_counter()
+    for i in range(frames):
+        moves[i // 10 % 2]()
+        drawer.draw(display)
+    elapsed = time.perf_counter() - start
+    print(f"panels frame time: {elapsed / frames * 1000:.3f} ms")
+
+
+def bench_zoom(sizes=range(50, 71), rounds=3):
+    # Зум в Main.py - это service_init(size, False) и новый спрайт героя
+    init_display()
+    # bench_render переводит Service в режим без окна, а зуму нужны
+    # настоящие текстуры
+    Service.service_init(60, headless=False)
+    hero_texture = os.path.join(Service.TEXTURE, "Hero.png")
+    for i in range(rounds):
+        start = time.perf_counter()
+        for size in sizes:
+            Service.create_sprite(hero_texture, size)
+            Service.service_init(size, False)
+        elapsed = time.perf_counter() - start
+        print(f"zoom round {i}: {elapsed / len(sizes) * 1000:.3f} ms per step")
+
+
+def bench_connectivity(sizes=(41, 250, 1000), rounds=5):
+    # Та же доля стен, что у !random_map
+    rng = random.Random(0)
+    choices = [TileMap.WALL] + [TileMap.FLOOR1] * 8
+    for size in sizes:
+        game_map = TileMap.TileMap.random(rng, size, size, choices,
+                                          Service.palette)
+        floor = game_map.tiles != TileMap.WALL
+        start = time.perf_counter()
+        for _ in range(rounds):
+            TileMap.label_regions(floor)
+        elapsed = time.perf_counter() - start
+        print(f"label regions {size}x{size}: {elapsed / rounds * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    bench_moves()
+    bench_render()
+    bench_zoom()
+    bench_connectivity()
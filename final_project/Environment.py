@@ -0,0 +1,160 @@
+import os
+import multiprocessing as mp
+import numpy as np
+import Randomness
+import Simulation
+
+
+class GameEnv:
+    """Одна игра в стиле gym: reset() и step(action).
+
+    Наблюдение - окно кодов клеток вокруг героя (см. Observation).
+    Seed каждого эпизода выводится из seed среды и номера эпизода.
+    """
+
+    def __init__(self, max_steps=1000, radius=5, seed=None):
+        self.max_steps = max_steps
+        self.radius = radius
+        self.random = Randomness.RandomStreams(seed)
+        self.episodes = 0
+        self.engine = None
+        self.steps = 0
+
+    def reset(self):
+        self.engine = Simulation.create_engine(
+            self.random.derive(f"episode/{self.episodes}"))
+        self.episodes += 1
+        self.actions = [getattr(self.engine, name)
+                        for name in Simulation.ACTIONS]
+        self.steps = 0
+        return self.observation()
+
+    def step(self, action):
+        prev_score = self.engine.score
+        self.actions[action]()
+        self.engine.events.dispatch()
+        self.steps += 1
+        reward = self.engine.score - prev_score
+        done = self.steps >= self.max_steps or \
+            Simulation.is_finished(self.engine)
+        return self.observation(), reward, done
+
+    def observation(self):
+        return self.engine.observe(self.radius)
+
+
+class SyncVectorEnv:
+    """N независимых игр, которые шагают одним массивом действий.
+
+    Завершившиеся игры сразу перезапускаются, их done в этом шаге True.
+    Игра с номером i получает i-й независимый поток от seed, first -
+    номер первой игры пачки.
+    """
+
+    def __init__(self, num_envs, max_steps=1000, radius=5, seed=None,
+                 first=0):
+        root = Randomness.RandomStreams(seed)
+        self.envs = [GameEnv(max_steps, radius, root.spawn(first + i).seed)
+                     for i in range(num_envs)]
+
+    @property
+    def num_envs(self):
+        return len(self.envs)
+
+    def reset(self):
+        return np.stack([env.reset() for env in self.envs])
+
+    def step(self, actions):
+        observations = []
+        rewards = np.empty(len(self.envs), dtype=np.float32)
+        dones = np.empty(len(self.envs), dtype=bool)
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            obs, rewards[i], dones[i] = env.step(action)
+            if dones[i]:
+                obs = env.reset()
+            observations.append(obs)
+        return np.stack(observations), rewards, dones
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _worker(conn, num_envs, max_steps, radius, seed, first):
+    envs = SyncVectorEnv(num_envs, max_steps, radius, seed, first)
+    while True:
+        command, data = conn.recv()
+        if command == "step":
+            conn.send(envs.step(data))
+        elif command == "reset":
+            conn.send(envs.reset())
+        elif command == "close":
+            conn.close()
+            break
+
+
+class ProcessVectorEnv(SyncVectorEnv):
+    """Тот же интерфейс, но игры разложены по процессам-воркерам.
+
+    Каждый воркер держит свою пачку игр и шагает её целиком, так что
+    на шаг приходится одно сообщение на воркер, а не на игру. Потоки
+    случайных чисел от числа воркеров не зависят.
+    """
+
+    def __init__(self, num_envs, max_steps=1000, radius=5, workers=None,
+                 seed=None):
+        workers = min(num_envs, workers or os.cpu_count() or 1)
+        seed = Randomness.new_seed() if seed is None else seed
+        sizes = [num_envs // workers + (i < num_envs % workers)
+                 for i in range(workers)]
+        self.bounds = np.cumsum([0] + sizes)
+        self.conns = []
+        self.processes = []
+        for size, first in zip(sizes, self.bounds):
+            parent, child = mp.Pipe()
+            process = mp.Process(target=_worker,
+                                 args=(child, size, max_steps, radius,
+                                       seed, int(first)),
+                                 daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    @property
+    def num_envs(self):
+        return int(self.bounds[-1])
+
+    def reset(self):
+        for conn in self.conns:
+            conn.send(("reset", None))
+        return np.concatenate([conn.recv() for conn in self.conns])
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        for conn, start, end in zip(self.conns, self.bounds, self.bounds[1:]):
+            conn.send(("step", actions[start:end]))
+        results = [conn.recv() for conn in self.conns]
+        return tuple(np.concatenate(part) for part in zip(*results))
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(("close", None))
+        for process in self.processes:
+            process.join()
+        self.conns = []
+        self.processes = []
+
+
+def make_vector_env(num_envs, backend="sync", max_steps=1000, radius=5,
+                    workers=None, seed=None):
+    if backend == "sync":
+        return SyncVectorEnv(num_envs, max_steps, radius, seed)
+    if backend == "process":
+        return ProcessVectorEnv(num_envs, max_steps, radius, workers, seed)
+    raise ValueError(f"Unknown backend: {backend}")
@@ -0,0 +1,267 @@
+import asyncio
+import collections
+import json
+import os
+import queue
+import threading
+import numpy as np
+
+# Запись события: тип, номер хода, клетка героя и данные события
+Event = collections.namedtuple("Event", "type step position payload")
+
+MESSAGE = "message"
+EXPERIENCE = "experience"
+FIGHT = "fight"
+DEATH = "death"
+HP_RESTORED = "hp_restored"
+EFFECT_APPLIED = "effect_applied"
+EFFECT_REMOVED = "effect_removed"
+POWER = "power"
+NOT_ENOUGH_GOLD = "not_enough_gold"
+CURSED = "cursed"
+GOLD = "gold"
+
+# Текст для окна сообщений, по типу события
+FORMATS = {
+    MESSAGE: "{text}",
+    EXPERIENCE: "Got {amount} experience",
+    FIGHT: "Enemy defeated! Lost {damage} HP",
+    DEATH: "You died! Restarting level...",
+    HP_RESTORED: "HP restored",
+    EFFECT_APPLIED: "{effect} applied",
+    EFFECT_REMOVED: "Effect removed",
+    POWER: "Power applied! Strength +7 (Cost: {cost} gold)",
+    NOT_ENOUGH_GOLD: "Not enough gold! Need {cost} gold for power.",
+    CURSED: "You were cursed",
+    GOLD: "{amount} gold added",
+}
+
+
+def format_event(event):
+    return FORMATS.get(event.type, event.type).format(**event.payload)
+
+
+def deliver(subscriber, events):
+    # Подписчик может принимать пачку целиком или события по одному
+    if hasattr(subscriber, "update_batch"):
+        return subscriber.update_batch(events)
+    for event in events:
+        subscriber.update(event)
+
+
+class EventBus:
+    """Очередь событий движка.
+
+    Движок только складывает события в очередь, подписчики получают их
+    пачкой в dispatch(), который вызывается раз в кадр или такт.
+    Подписка может быть ограничена набором типов событий.
+    """
+
+    def __init__(self):
+        self.queue = []
+        self.subscribers = {}
+
+    def subscribe(self, subscriber, types=None):
+        self.subscribers[subscriber] = \
+            frozenset(types) if types is not None else None
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.pop(subscriber, None)
+
+    def post(self, event):
+        # Без подписчиков события некому доставлять
+        if self.subscribers:
+            self.queue.append(event)
+
+    def dispatch(self):
+        if not self.queue:
+            return
+        events, self.queue = self.queue, []
+        for subscriber, types in list(self.subscribers.items()):
+            if types is None:
+                deliver(subscriber, events)
+            else:
+                selected = [event for event in events if event.type in types]
+                if selected:
+                    deliver(subscriber, selected)
+
+
+class ThreadedSubscriber:
+    """Подписчик, который обрабатывает события в фоновом потоке.
+
+    Между движком и потоком не больше max_pending пачек. Когда очередь
+    заполнена, dispatch() ждёт (block=True) или пачка отбрасывается и
+    учитывается в dropped. Исключение подписчика не останавливает поток:
+    пачка считается в errors, последнее исключение - в last_error.
+    """
+
+    def __init__(self, subscriber, max_pending=64, block=True):
+        self.subscriber = subscriber
+        self.block = block
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self.queue = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def update_batch(self, events):
+        try:
+            self.queue.put(events, block=self.block)
+        except queue.Full:
+            self.dropped += len(events)
+
+    def run(self):
+        while True:
+            events = self.queue.get()
+            try:
+                if events is None:
+                    break
+                deliver(self.subscriber, events)
+            except Exception as error:
+                self.errors += 1
+                self.last_error = error
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class AsyncioSubscriber:
+    """Подписчик, который обрабатывает события задачей в цикле asyncio.
+
+    update / update_batch подписчика могут быть корутинами. Ограничение
+    очереди то же, что у ThreadedSubscriber; ждать свободного места
+    (block=True) можно только если dispatch() вызывается не из потока
+    цикла, иначе пачки нужно отбрасывать. Исключения подписчика
+    учитываются так же, как у ThreadedSubscriber.
+    """
+
+    def __init__(self, subscriber, loop, max_pending=64, block=True):
+        self.subscriber = subscriber
+        self.loop = loop
+        self.block = block
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.queue = asyncio.Queue()
+        self.task = asyncio.run_coroutine_threadsafe(self.run(), loop)
+
+    def update_batch(self, events):
+        if not self.slots.acquire(blocking=self.block):
+            self.dropped += len(events)
+            return
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, events)
+
+    async def run(self):
+        while True:
+            events = await self.queue.get()
+            if events is None:
+                break
+            try:
+                if hasattr(self.subscriber, "update_batch"):
+                    result = self.subscriber.update_batch(events)
+                    if asyncio.iscoroutine(result):
+                        await result
+                else:
+                    for event in events:
+                        result = self.subscriber.update(event)
+                        if asyncio.iscoroutine(result):
+                            await result
+            except Exception as error:
+                self.errors += 1
+                self.last_error = error
+            finally:
+                self.slots.release()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+        self.task.result()
+
+
+class EventLog:
+    """Последние события движка и счётчики по типам.
+
+    Хранит не больше capacity записей. Если открыт дамп, все события
+    дописываются и в него.
+    """
+
+    def __init__(self, capacity=1000):
+        self.events = collections.deque(maxlen=capacity)
+        self.counts = collections.Counter()
+        self.dump = None
+
+    def update_batch(self, events):
+        self.events.extend(events)
+        self.counts.update(event.type for event in events)
+        if self.dump is not None:
+            self.dump.append(events)
+
+    def open_dump(self, path):
+        self.dump = EventDump(path)
+        return self.dump
+
+
+class EventDump:
+    """Дамп событий партии по столбцам, только на дозапись.
+
+    В каталоге path лежат файлы step, x, y и type с массивами чисел,
+    types.txt с именами типов (номер строки - код в type) и
+    payload.jsonl с данными событий.
+    """
+
+    COLUMNS = (("step", np.int64), ("x", np.int32), ("y", np.int32),
+               ("type", np.uint16))
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.types = load_types(path)
+        self.codes = {name: code for code, name in enumerate(self.types)}
+
+    def code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.types)
+            self.types.append(name)
+            with open(os.path.join(self.path, "types.txt"), "a") as file:
+                file.write(name + "\n")
+        return code
+
+    def append(self, events):
+        columns = {
+            "step": [event.step for event in events],
+            "x": [event.position[0] for event in events],
+            "y": [event.position[1] for event in events],
+            "type": [self.code(event.type) for event in events],
+        }
+        for name, dtype in self.COLUMNS:
+            with open(os.path.join(self.path, name), "ab") as file:
+                file.write(np.asarray(columns[name], dtype=dtype).tobytes())
+        with open(os.path.join(self.path, "payload.jsonl"), "a") as file:
+            file.writelines(json.dumps(event.payload) + "\n"
+                            for event in events)
+
+
+def load_types(path):
+    types_path = os.path.join(path, "types.txt")
+    if not os.path.exists(types_path):
+        return []
+    with open(types_path) as file:
+        return file.read().splitlines()
+
+
+def load_dump(path):
+    """Столбцы дампа EventDump: массивы NumPy, types и payload."""
+    columns = {name: np.fromfile(os.path.join(path, name), dtype=dtype)
+               for name, dtype in EventDump.COLUMNS}
+    columns["types"] = load_types(path)
+    with open(os.path.join(path, "payload.jsonl")) as file:
+        columns["payload"] = [json.loads(line) for line in file]
+    return columns
@@ -0,0 +1,175 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import time
+import numpy as np
+import Service
+import Snapshot
+
+
+def init_worker():
+    # Воркеру не нужны ни окно, ни текстуры
+    if not Service.HEADLESS:
+        Service.service_init(0, headless=True)
+
+
+def generator_names():
+    """Имена генераторов levels.yml по порядку: номер и класс карты."""
+    init_worker()
+    # Последний в level_list - EndMap, он добавляется не из levels.yml
+    return [f"{index}:{type(entry['map']).__qualname__.split('.')[0]}"
+            for index, entry in enumerate(Service.level_list[:-1])]
+
+
+def generate_batch(task):
+    """Строит count уровней генератора index и пишет их в один .npz.
+
+    Seed уровня зависит только от seed, номера генератора и номера
+    уровня, поэтому результат не зависит от числа воркеров.
+    """
+    index, first, count, seed, out_dir = task
+    entry = Service.level_list[index]
+    keys = Snapshot.object_keys()
+    table = []
+    numbers = []
+    shapes = []
+    tiles = []
+    levels, codes, xs, ys = [], [], [], []
+    failures = 0
+    elapsed = 0.
+    for number in range(first, first + count):
+        rng = random.Random(f"{seed}/{index}/{number}")
+        start = time.perf_counter()
+        try:
+            _map = entry['map'].get_map(rng)
+            objects = entry['obj'].get_objects(_map, rng)
+        except Service.PlacementError:
+            failures += 1
+            continue
+        finally:
+            elapsed += time.perf_counter() - start
+        level = len(shapes)
+        numbers.append(number)
+        shapes.append(_map.tiles.shape)
+        tiles.append(_map.tiles.ravel())
+        for obj in objects:
+            key = keys[id(obj.sprite)]
+            if key not in table:
+                table.append(key)
+            levels.append(level)
+            codes.append(table.index(key))
+            xs.append(obj.position[0])
+            ys.append(obj.position[1])
+
+    path = os.path.join(out_dir, f"levels-{index}-{first:08d}.npz")
+    np.savez_compressed(
+        path,
+        numbers=np.array(numbers, dtype=np.int64),
+        shapes=np.array(shapes, dtype=np.int32).reshape(-1, 2),
+        tiles=np.concatenate(tiles) if tiles else np.empty(0, np.uint8),
+        object_level=np.array(levels, dtype=np.int32),
+        object_code=np.array(codes, dtype=np.uint16),
+        object_x=np.array(xs, dtype=np.int32),
+        object_y=np.array(ys, dtype=np.int32),
+        kinds=np.array(["/".join(key) for key in table], dtype=str))
+
+    counts = np.zeros((len(shapes), len(table)), dtype=np.int64)
+    np.add.at(counts, (np.array(levels, dtype=np.int64),
+                       np.array(codes, dtype=np.int64)), 1)
+    return {"index": index, "levels": len(shapes), "failures": failures,
+            "seconds": elapsed,
+            "entities": {"/".join(key): counts[:, code].tolist()
+                         for code, key in enumerate(table)}}
+
+
+def load_batch(path):
+    """Уровни файла generate_batch: список (tiles, [(kind, x, y), ...])."""
+    data = np.load(path)
+    kinds = data["kinds"].tolist()
+    offsets = np.concatenate([[0], np.cumsum(np.prod(data["shapes"], axis=1))])
+    levels = []
+    for level, shape in enumerate(data["shapes"].tolist()):
+        tiles = data["tiles"][offsets[level]:offsets[level + 1]].reshape(shape)
+        mask = data["object_level"] == level
+        objects = [(kinds[code], x, y) for code, x, y in zip(
+            data["object_code"][mask].tolist(), data["object_x"][mask].tolist(),
+            data["object_y"][mask].tolist())]
+        levels.append((tiles, objects))
+    return levels
+
+
+def merge_stats(names, results):
+    stats = {name: {"levels": 0, "failures": 0, "seconds": 0.,
+                    "entities": {}} for name in names}
+    for result in results:
+        item = stats[names[result["index"]]]
+        item["levels"] += result["levels"]
+        item["failures"] += result["failures"]
+        item["seconds"] += result["seconds"]
+        for kind, counts in result["entities"].items():
+            item["entities"].setdefault(kind, []).extend(counts)
+
+    for item in stats.values():
+        levels = item["levels"]
+        item["ms_per_level"] = item["seconds"] / levels * 1000 if levels else 0.
+        entities = {}
+        for kind, counts in sorted(item["entities"].items()):
+            # Уровни без объектов этого вида в counts не попали
+            counts = counts + [0] * (levels - len(counts))
+            entities[kind] = {"mean": float(np.mean(counts)),
+                              "min": int(np.min(counts)),
+                              "max": int(np.max(counts))}
+        item["entities"] = entities
+    return stats
+
+
+def run(count, out_dir, workers=None, seed=0, batch=100, generators=None):
+    """Строит count уровней каждого генератора пулом из workers процессов."""
+    os.makedirs(out_dir, exist_ok=True)
+    names = generator_names()
+    indices = range(len(names)) if generators is None else generators
+    tasks = [(index, first, min(batch, count - first), seed, out_dir)
+             for index in indices for first in range(0, count, batch)]
+    start = time.perf_counter()
+    with mp.Pool(workers or os.cpu_count(), initializer=init_worker) as pool:
+        results = list(pool.imap_unordered(generate_batch, tasks))
+    wall_time = time.perf_counter() - start
+
+    stats = merge_stats(names, results)
+    with open(os.path.join(out_dir, "stats.json"), "w") as file:
+        json.dump({"count": count, "seed": seed, "wall_seconds": wall_time,
+                   "generators": stats}, file, indent=2)
+    return stats, wall_time
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk generation of levels.yml levels without pygame")
+    parser.add_argument("-n", "--count", type=int, default=1000,
+                        help="levels per generator")
+    parser.add_argument("-o", "--out", default="generated_levels")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch", type=int, default=100,
+                        help="levels per task and per output file")
+    parser.add_argument("-g", "--generator", type=int, action="append",
+                        help="generator index in levels.yml, repeatable")
+    args = parser.parse_args()
+
+    stats, wall_time = run(args.count, args.out, args.workers, args.seed,
+                           args.batch, args.generator)
+    for name, item in stats.items():
+        if not item["levels"] and not item["failures"]:
+            continue
+        print(f"{name}: {item['levels']} levels, {item['failures']} failed, "
+              f"{item['ms_per_level']:.3f} ms/level")
+        for kind, counts in item["entities"].items():
+            print(f"    {kind:<24} mean {counts['mean']:6.2f} "
+                  f"min {counts['min']:3d} max {counts['max']:3d}")
+    print(f"total {wall_time:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,77 +1,228 @@
+import copy
+import Events
+import Observation
+import Pathfinding
+import Randomness
 import Service
+import Visibility
+
+
+class ObjectIndex:
+    """Объекты уровня с индексом по клеткам карты.
+
+    Итерация идёт в порядке добавления, как у обычного списка, а поиск
+    объектов в клетке и удаление выполняются за O(1).
+    """
+
+    def __init__(self, objects=()):
+        self._objects = {}
+        self._cells = {}
+        # Словари общие с копией из fork() до первого изменения
+        self._shared = False
+        for obj in objects:
+            self.add(obj)
+
+    def fork(self):
+        """Копия индекса, которая копирует данные только при изменении."""
+        other = ObjectIndex.__new__(ObjectIndex)
+        other._objects = self._objects
+        other._cells = self._cells
+        other._shared = self._shared = True
+        return other
+
+    def _own(self):
+        if self._shared:
+            self._objects = dict(self._objects)
+            self._cells = {cell: list(bucket)
+                           for cell, bucket in self._cells.items()}
+            self._shared = False
+
+    def __iter__(self):
+        return iter(list(self._objects))
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, obj):
+        return obj in self._objects
+
+    def add(self, obj):
+        self._own()
+        cell = tuple(obj.position)
+        self._objects[obj] = cell
+        self._cells.setdefault(cell, []).append(obj)
+
+    def remove(self, obj):
+        self._own()
+        cell = self._objects.pop(obj)
+        bucket = self._cells[cell]
+        bucket.remove(obj)
+        if not bucket:
+            del self._cells[cell]
+
+    def at(self, position):
+        return self._cells.get(tuple(position), ())
+
+    def clear(self):
+        self._objects = {}
+        self._cells = {}
+        self._shared = False
 
 
 class GameEngine:
-    objects = []
-    map = None
-    hero = None
-    level = -1
-    working = True
-    subscribers = set()
-    score = 0.
-    game_process = True
-    show_help = False
-
-    def subscribe(self, obj):
-        self.subscribers.add(obj)
+
+    def __init__(self, seed=None):
+        self.objects = ObjectIndex()
+        # Все случайные решения движка берутся из его потоков
+        self.random = Randomness.RandomStreams(seed)
+        self.map = None
+        self.hero = None
+        self.level = -1
+        self.levels = None
+        self.working = True
+        # События доставляются подписчикам пачкой в events.dispatch()
+        self.events = Events.EventBus()
+        self.log = Events.EventLog()
+        self.events.subscribe(self.log)
+        # Номер хода для записей событий
+        self.step = 0
+        self.score = 0.
+        self.game_process = True
+        self.show_help = False
+        self.show_frame_times = False
+        self.show_minimap = False
+        self.observation = Observation.ObservationGrid(self)
+        self.enemy_ai = Pathfinding.EnemyAI(self)
+        self.fov = Visibility.FieldOfView(self)
+        # Наблюдатели за объектами уровня: object_added / object_removed /
+        # object_moved
+        self.watchers = [self.observation, self.enemy_ai]
+        # Запись ходов для повтора, см. Replay.Recorder
+        self.recorder = None
+
+    def clone(self):
+        """Независимая копия движка для перебора ходов.
+
+        Карта и спрайты общие, индекс объектов копируется при первом
+        изменении, герой копируется целиком (это несколько полей).
+        Объекты общие: движок их не меняет, а заменяет копиями.
+        Подписчики и наблюдатели интерфейса в копию не переходят.
+        """
+        other = GameEngine.__new__(GameEngine)
+        other.__dict__.update(self.__dict__)
+        other.objects = self.objects.fork()
+        other.hero = self.hero.clone() if self.hero is not None else None
+        other.random = self.random.clone()
+        if self.levels is not None:
+            other.levels = Service.LevelPipeline(self.levels.seed,
+                                                 prefetch=False)
+        other.events = Events.EventBus()
+        other.log = Events.EventLog()
+        other.events.subscribe(other.log)
+        other.observation = Observation.ObservationGrid(other)
+        other.enemy_ai = self.enemy_ai.clone(other)
+        other.fov = Visibility.FieldOfView(other)
+        other.watchers = [other.observation, other.enemy_ai]
+        other.recorder = None
+        return other
+
+    def subscribe(self, obj, types=None):
+        self.events.subscribe(obj, types)
 
     def unsubscribe(self, obj):
-        if obj in self.subscribers:
-            self.subscribers.remove(obj)
+        self.events.unsubscribe(obj)
+
+    def emit(self, event_type, **payload):
+        self.events.post(Events.Event(event_type, self.step,
+                                      tuple(self.hero.position), payload))
 
     def notify(self, message):
-        for i in self.subscribers:
-            i.update(message)
+        self.emit(Events.MESSAGE, text=message)
 
     # HERO
     def add_hero(self, hero):
         self.hero = hero
 
     def interact(self):
-        for obj in self.objects:
-            if list(obj.position) == self.hero.position:
-                self.delete_object(obj)
-                obj.interact(self, self.hero)
+        for obj in list(self.objects.at(self.hero.position)):
+            self.delete_object(obj)
+            obj.interact(self, self.hero)
 
     # MOVEMENT
-    def move_up(self):
+    def move(self, dx, dy):
+        if self.recorder is not None:
+            self.recorder.record(dx, dy)
+        self.step += 1
         self.score -= 0.02
-        if self.map[self.hero.position[1] - 1][self.hero.position[0]] == Service.wall:
-            return
-        self.hero.position[1] -= 1
-        self.interact()
+        position = self.hero.position
+        if not self.map.is_wall(position[0] + dx, position[1] + dy):
+            position[0] += dx
+            position[1] += dy
+            self.map.focus(position[0], position[1])
+            self.interact()
+        # Враги ходят после каждого хода героя, даже упёршегося в стену
+        self.enemy_ai.tick()
+        if self.fov.tracking:
+            self.fov.update()
+
+    def move_up(self):
+        self.move(0, -1)
 
     def move_down(self):
-        self.score -= 0.02
-        if self.map[self.hero.position[1] + 1][self.hero.position[0]] == Service.wall:
-            return
-        self.hero.position[1] += 1
-        self.interact()
+        self.move(0, 1)
 
     def move_left(self):
-        self.score -= 0.02
-        if self.map[self.hero.position[1]][self.hero.position[0] - 1] == Service.wall:
-            return
-        self.hero.position[0] -= 1
-        self.interact()
+        self.move(-1, 0)
 
     def move_right(self):
-        self.score -= 0.02
-        if self.map[self.hero.position[1]][self.hero.position[0] + 1] == Service.wall:
-            return
-        self.hero.position[0] += 1
-        self.interact()
+        self.move(1, 0)
+
+    # OBSERVATION
+    def observe(self, radius=None, one_hot=False):
+        """Компактное наблюдение: массив кодов клеток из Observation.
+
+        radius задаёт окно (2 * radius + 1) клеток вокруг героя, one_hot
+        раскладывает коды по каналам.
+        """
+        return self.observation.observe(radius, one_hot)
 
     # MAP
     def load_map(self, game_map):
         self.map = game_map
 
     # OBJECTS
+    def watch_objects(self, watcher):
+        if watcher not in self.watchers:
+            self.watchers.append(watcher)
+
     def add_object(self, obj):
-        self.objects.append(obj)
+        self.objects.add(obj)
+        for watcher in self.watchers:
+            watcher.object_added(obj)
 
     def add_objects(self, objects):
-        self.objects.extend(objects)
+        for obj in objects:
+            self.add_object(obj)
+
+    def move_object(self, obj, position):
+        """Переносит объект в клетку position и возвращает его копию.
+
+        Объекты могут быть общими с копиями движка из clone(), поэтому
+        на новое место ставится копия, а не изменённый объект.
+        """
+        moved = copy.copy(obj)
+        moved.position = tuple(position)
+        self.objects.remove(obj)
+        self.objects.add(moved)
+        for watcher in self.watchers:
+            watcher.object_moved(obj, moved)
+        return moved
 
     def delete_object(self, obj):
         self.objects.remove(obj)
+        for watcher in self.watchers:
+            watcher.object_removed(obj)
+
+    def clear_objects(self):
+        for obj in self.objects:
+            self.delete_object(obj)
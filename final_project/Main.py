@@ -4,14 +4,25 @@ import Objects
 import ScreenEngine
 import Logic
 import Service
+import Replay
+import Scheduler
+import Snapshot
 
 
 SCREEN_DIM = (800, 600)
+FPS = 60
+QUICKSAVE = os.path.join(Service.BASE_DIR, "quicksave.bin")
+# Запись последней партии для повтора через Replay.Replayer
+REPLAY = os.path.join(Service.BASE_DIR, "last_game.replay")
+# None - новая случайная игра, число - воспроизводимая
+SEED = None
 
 pygame.init()
 gameDisplay = pygame.display.set_mode(SCREEN_DIM)
 pygame.display.set_caption("MyRPG")
 KEYBOARD_CONTROL = True
+# В режиме клавиатуры экран перерисовывается только после ввода
+scheduler = Scheduler.FrameScheduler(FPS, idle=KEYBOARD_CONTROL)
 
 if not KEYBOARD_CONTROL:
     import numpy as np
@@ -30,17 +41,20 @@ def create_game(sprite_size, is_new):
     if is_new:
         hero = Objects.Hero(base_stats, Service.create_sprite(
             os.path.join("texture", "Hero.png"), sprite_size))
-        engine = Logic.GameEngine()
+        engine = Logic.GameEngine(SEED)
         Service.service_init(sprite_size)
         Service.reload_game(engine, hero)
-        with ScreenEngine as SE:
-            drawer = SE.GameSurface((640, 480), pygame.SRCALPHA, (0, 480),
-                                    SE.ProgressBar((640, 120), (640, 0),
-                                                   SE.InfoWindow((160, 600), (50, 50),
-                                                                 SE.HelpWindow((700, 500), pygame.SRCALPHA, (0, 0),
-                                                                               SE.ScreenHandle(
-                                                                                   (0, 0))
-                                                                               ))))
+        engine.recorder = Replay.Recorder(engine)
+        SE = ScreenEngine
+        drawer = SE.GameSurface((640, 480), pygame.SRCALPHA, (0, 480),
+                                SE.ProgressBar((640, 120), (640, 0),
+                                               SE.InfoWindow((160, 600), (50, 50),
+                                                             SE.HelpWindow((700, 500), pygame.SRCALPHA, (10, 10),
+                                                                           SE.FrameTimeWindow((240, 120), pygame.SRCALPHA, (475, 5),
+                                                                                              SE.MinimapWindow((160, 160), pygame.SRCALPHA, (0, 0),
+                                                                                                               SE.ScreenHandle(
+                                                                                                                   (0, 0))
+                                                                                                               ))))))
 
     else:
         engine.sprite_size = sprite_size
@@ -49,6 +63,7 @@ def create_game(sprite_size, is_new):
         Service.service_init(sprite_size, False)
 
     Logic.GameEngine.sprite_size = sprite_size
+    engine.frame_times = scheduler.frame_times
 
     drawer.connect_engine(engine)
 
@@ -61,12 +76,16 @@ create_game(size, True)
 while engine.working:
 
     if KEYBOARD_CONTROL:
-        for event in pygame.event.get():
+        for event in scheduler.get_events():
             if event.type == pygame.QUIT:
                 engine.working = False
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_h:
                     engine.show_help = not engine.show_help
+                if event.key == pygame.K_m:
+                    engine.show_minimap = not engine.show_minimap
+                if event.key == pygame.K_f:
+                    engine.show_frame_times = not engine.show_frame_times
                 if event.key == pygame.K_KP_PLUS:
                     size = size + 1
                     create_game(size, False)
@@ -75,6 +94,16 @@ while engine.working:
                     create_game(size, False)
                 if event.key == pygame.K_r:
                     create_game(size, True)
+                if event.key == pygame.K_F5:
+                    with open(QUICKSAVE, "wb") as file:
+                        file.write(Snapshot.save(engine))
+                    engine.notify("Game saved")
+                if event.key == pygame.K_F9 and os.path.exists(QUICKSAVE):
+                    with open(QUICKSAVE, "rb") as file:
+                        data = file.read()
+                    Snapshot.restore(engine, data)
+                    engine.recorder = Replay.Recorder(engine, data)
+                    engine.notify("Game loaded")
                 if event.key == pygame.K_ESCAPE:
                     engine.working = False
                 if engine.game_process:
@@ -94,9 +123,10 @@ while engine.working:
                     if event.key == pygame.K_RETURN:
                         create_game()
     else:
-        for event in pygame.event.get():
+        for event in scheduler.get_events():
             if event.type == pygame.QUIT:
                 engine.working = False
+        scheduler.invalidate()
         if engine.game_process:
             actions = [
                 engine.move_right,
@@ -104,20 +134,27 @@ while engine.working:
                 engine.move_up,
                 engine.move_down,
             ]
-            answer = np.random.randint(0, 100, 4)
+            answer = engine.random.numpy("policy").integers(0, 100, 4)
             prev_score = engine.score
             move = actions[np.argmax(answer)]()
-            state = pygame.surfarray.array3d(gameDisplay)
+            state = engine.observe()
             reward = engine.score - prev_score
             print(reward)
         else:
             create_game()
 
-    gameDisplay.blit(drawer, (0, 0))
-    drawer.draw(gameDisplay)
+    # События хода доставляются один раз за такт, до отрисовки
+    engine.events.dispatch()
+    if scheduler.dirty:
+        scheduler.begin_frame()
+        gameDisplay.blit(drawer, (0, 0))
+        drawer.draw(gameDisplay)
 
-    pygame.display.update()
+        pygame.display.update()
+        scheduler.end_frame()
+    scheduler.tick()
 
+engine.recorder.save(REPLAY)
 pygame.display.quit()
 pygame.quit()
 exit(0)
@@ -1,6 +1,12 @@
 from abc import ABC, abstractmethod
-import pygame
+import copy
 import random
+import Events
+# Без pygame доступен только режим без окна (Service.HEADLESS)
+try:
+    import pygame
+except ImportError:
+    pygame = None
 
 
 def create_sprite(img, sprite_size):
@@ -57,108 +63,101 @@ class Hero(Creature):
         self.level = 1
         self.exp = 0
         self.gold = 0
+        # Эффекты хранятся стеком модификаторов поверх базовых
+        # характеристик, итоговые характеристики кэшируются
+        self.effects = []
         super().__init__(icon, stats, pos)
 
+    @property
+    def stats(self):
+        if self._stats is None:
+            stats = self.base_stats.copy()
+            for effect in self.effects:
+                effect.apply_effect(stats)
+            self._stats = stats
+        return self._stats
+
+    @stats.setter
+    def stats(self, value):
+        self.base_stats = dict(value)
+        self._stats = None
+
+    def add_effect(self, effect):
+        self.effects.append(effect)
+        self._stats = None
+        self.calc_max_HP()
+        if effect.restores_hp:
+            self.hp = self.max_hp
+        else:
+            self.hp = min(self.hp, self.max_hp)
+
+    def remove_effect(self, effect=None):
+        """Снимает эффект со стека, по умолчанию последний наложенный."""
+        if effect is None:
+            effect = self.effects.pop()
+        else:
+            self.effects.remove(effect)
+        self._stats = None
+        self.calc_max_HP()
+        self.hp = min(self.hp, self.max_hp)
+        return effect
+
     def level_up(self):
         while self.exp >= 100 * (2 ** (self.level - 1)):
             yield "level up!"
             self.level += 1
-            self.stats["strength"] += 2
-            self.stats["endurance"] += 2
+            self.base_stats["strength"] += 2
+            self.base_stats["endurance"] += 2
+            self._stats = None
             self.calc_max_HP()
             self.hp = self.max_hp
 
+    def clone(self):
+        # Эффекты не хранят состояния и разделяются копиями
+        hero = copy.copy(self)
+        hero.base_stats = self.base_stats.copy()
+        hero.effects = list(self.effects)
+        hero._stats = None
+        hero.position = list(self.position)
+        return hero
 
-class Effect(Hero):
 
-    def __init__(self, base):
-        self.base = base
-        self.stats = self.base.stats.copy()
-        self.apply_effect()
+class Effect(ABC):
+    """Модификатор характеристик героя в стеке Hero.effects."""
 
-    @property
-    def position(self):
-        return self.base.position
-
-    @position.setter
-    def position(self, value):
-        self.base.position = value
-
-    @property
-    def level(self):
-        return self.base.level
-
-    @level.setter
-    def level(self, value):
-        self.base.level = value
-
-    @property
-    def gold(self):
-        return self.base.gold
-
-    @gold.setter
-    def gold(self, value):
-        self.base.gold = value
-
-    @property
-    def hp(self):
-        return self.base.hp
-
-    @hp.setter
-    def hp(self, value):
-        self.base.hp = value
-
-    @property
-    def max_hp(self):
-        return self.base.max_hp
-
-    @max_hp.setter
-    def max_hp(self, value):
-        self.base.max_hp = value
-
-    @property
-    def exp(self):
-        return self.base.exp
-
-    @exp.setter
-    def exp(self, value):
-        self.base.exp = value
-
-    @property
-    def sprite(self):
-        return self.base.sprite
+    restores_hp = False
 
     @abstractmethod
-    def apply_effect(self):
+    def apply_effect(self, stats):
         pass
 
 
 class Berserk(Effect):
-    def apply_effect(self):
-        self.stats["strength"] += 5
-        self.stats["endurance"] += 5
-        self.base.calc_max_HP()
-        self.base.hp = self.base.max_hp
+    restores_hp = True
+
+    def apply_effect(self, stats):
+        stats["strength"] += 5
+        stats["endurance"] += 5
 
 
 class Blessing(Effect):
-    def apply_effect(self):
-        self.stats["strength"] += 3
-        self.stats["endurance"] += 3
-        self.stats["luck"] += 3
-        self.base.calc_max_HP()
-        self.base.hp = self.base.max_hp
+    restores_hp = True
+
+    def apply_effect(self, stats):
+        stats["strength"] += 3
+        stats["endurance"] += 3
+        stats["luck"] += 3
 
 
 class Weakness(Effect):
-    def apply_effect(self):
-        self.stats["strength"] = max(1, self.stats["strength"] - 3)
-        self.stats["endurance"] = max(1, self.stats["endurance"] - 3)
+    def apply_effect(self, stats):
+        stats["strength"] = max(1, stats["strength"] - 3)
+        stats["endurance"] = max(1, stats["endurance"] - 3)
 
 class Power(Effect):
-    def apply_effect(self):
+    def apply_effect(self, stats):
         # Просто увеличиваем силу на 7
-        self.stats["strength"] += 7
+        stats["strength"] += 7
 
 class Enemy(Creature, Interactive):
     def __init__(self, icon, stats, experience, position):
@@ -167,16 +166,15 @@ class Enemy(Creature, Interactive):
         
     def interact(self, engine, hero):
         hero.exp += self.experience
-        engine.notify(f"Got {self.experience} experience")
+        engine.emit(Events.EXPERIENCE, amount=self.experience)
         
         # Calculate damage
         damage = max(0, self.stats["strength"] - hero.stats["endurance"])
         hero.hp = max(0, hero.hp - damage)
         
         if hero.hp <= 0:
+            engine.emit(Events.DEATH, damage=damage)
             hero.position = [1, 1]
             hero.hp = hero.max_hp
-            engine.notify("You died! Restarting level...")
         else:
-            engine.objects.remove(self)
-            engine.notify(f"Enemy defeated! Lost {damage} HP")
\ No newline at end of file
+            engine.emit(Events.FIGHT, damage=damage)
\ No newline at end of file
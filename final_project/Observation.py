@@ -0,0 +1,130 @@
+import numpy as np
+import Objects
+import Service
+import TileMap
+
+# Коды клеток наблюдения; коды рельефа совпадают с идентификаторами тайлов
+WALL = TileMap.WALL
+FLOOR1 = TileMap.FLOOR1
+FLOOR2 = TileMap.FLOOR2
+FLOOR3 = TileMap.FLOOR3
+ENEMY = 4
+ALLY = 5
+STAIRS = 6
+HERO = 7
+CODES = 8
+
+
+def object_code(obj):
+    if isinstance(obj, Objects.Enemy):
+        return ENEMY
+    if getattr(obj, "action", None) is Service.reload_game:
+        return STAIRS
+    return ALLY
+
+
+class ObservationGrid:
+    """Карта уровня в виде массива uint8, по одному коду на клетку.
+
+    Рельеф строится один раз на карту, объекты и герой накладываются
+    поверх и обновляются по одной клетке, когда движок сообщает об
+    изменениях.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.map = None
+        self.hero_cell = None
+
+    def rebuild(self):
+        engine = self.engine
+        self.map = engine.map
+        self.terrain = engine.map.tiles.copy()
+        self.codes = self.terrain.copy()
+        for obj in engine.objects:
+            x, y = obj.position
+            self.codes[y, x] = object_code(obj)
+        self.hero_cell = None
+        self.sync_hero()
+
+    def refresh(self, cell):
+        # После смены карты сетка перестраивается целиком при наблюдении
+        if self.map is not self.engine.map:
+            return
+        x, y = cell
+        if cell == self.hero_cell:
+            self.codes[y, x] = HERO
+            return
+        objects = self.engine.objects.at(cell)
+        if objects:
+            self.codes[y, x] = object_code(objects[-1])
+        else:
+            self.codes[y, x] = self.terrain[y, x]
+
+    def object_added(self, obj):
+        self.refresh(tuple(obj.position))
+
+    def object_removed(self, obj):
+        self.refresh(tuple(obj.position))
+
+    def object_moved(self, obj, moved):
+        self.refresh(tuple(obj.position))
+        self.refresh(tuple(moved.position))
+
+    def sync_hero(self):
+        # Герой перемещается не только в move_*, поэтому его клетка
+        # сверяется перед каждым наблюдением
+        cell = tuple(self.engine.hero.position)
+        if cell != self.hero_cell:
+            old, self.hero_cell = self.hero_cell, cell
+            if old is not None:
+                self.refresh(old)
+            self.refresh(cell)
+
+    def observe(self, radius=None, one_hot=False):
+        if not hasattr(self.engine.map, "tiles"):
+            codes = self.observe_window(radius)
+        else:
+            codes = self.observe_grid(radius)
+        if one_hot:
+            return (codes == np.arange(CODES, dtype=np.uint8)[:, None, None]) \
+                .astype(np.uint8)
+        return codes
+
+    def observe_window(self, radius):
+        # Большая карта целиком не хранится: окно собирается из нужных
+        # чанков и объектов в нём
+        if radius is None:
+            raise ValueError("Chunked maps can only be observed with a radius")
+        x, y = self.engine.hero.position
+        codes = self.engine.map.region(x - radius, y - radius,
+                                       x + radius + 1, y + radius + 1)
+        objects = self.engine.objects
+        for dy in range(2 * radius + 1):
+            for dx in range(2 * radius + 1):
+                found = objects.at((x - radius + dx, y - radius + dy))
+                if found:
+                    codes[dy, dx] = object_code(found[-1])
+        codes[radius, radius] = HERO
+        return codes
+
+    def observe_grid(self, radius):
+        if self.map is not self.engine.map:
+            self.rebuild()
+        else:
+            self.sync_hero()
+        codes = self.codes
+        if radius is not None:
+            # Окно вокруг героя, за краем карты - стены
+            size = 2 * radius + 1
+            window = np.full((size, size), WALL, dtype=np.uint8)
+            x, y = self.hero_cell
+            height, width = codes.shape
+            x0, y0 = max(0, x - radius), max(0, y - radius)
+            x1, y1 = min(width, x + radius + 1), min(height, y + radius + 1)
+            window[y0 - y + radius:y1 - y + radius,
+                   x0 - x + radius:x1 - x + radius] = codes[y0:y1, x0:x1]
+            codes = window
+        else:
+            codes = codes.copy()
+        return codes
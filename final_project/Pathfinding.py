@@ -0,0 +1,202 @@
+import collections
+import numpy as np
+import Objects
+import TileMap
+
+UNREACHABLE = 1 << 40
+
+
+class FlowField:
+    """Поле расстояний BFS от героя по проходимым клеткам.
+
+    Поле строится по окну карты (walls - маска стен, origin - клетка
+    карты в его левом верхнем углу). Значения хранятся со сдвигом:
+    расстояние клетки равно field + offset, поэтому при шаге героя на
+    соседнюю клетку меняются только клетки, к которым стало ближе.
+    """
+
+    def __init__(self, walls, origin=(0, 0), margin=0):
+        height, width = walls.shape
+        # Окно обводится стеной, чтобы у клеток не было соседей за краем
+        padded = np.ones((height + 2, width + 2), dtype=bool)
+        padded[1:-1, 1:-1] = walls
+        self.walls = padded.ravel().tolist()
+        self.width = width + 2
+        self.height = height + 2
+        self.origin = origin
+        self.margin = margin
+        self.steps = (1, -1, self.width, -self.width)
+        self.field = None
+        self.source = None
+        self.offset = 0
+
+    def index(self, x, y):
+        return (y - self.origin[1] + 1) * self.width + x - self.origin[0] + 1
+
+    def cell(self, i):
+        y, x = divmod(i, self.width)
+        return x - 1 + self.origin[0], y - 1 + self.origin[1]
+
+    def inside(self, x, y):
+        x -= self.origin[0]
+        y -= self.origin[1]
+        margin = self.margin
+        return margin <= x < self.width - 2 - margin and \
+            margin <= y < self.height - 2 - margin
+
+    def clone(self):
+        """Копия поля: стены общие, значения копируются."""
+        other = FlowField.__new__(FlowField)
+        other.__dict__.update(self.__dict__)
+        if self.field is not None:
+            other.field = list(self.field)
+        return other
+
+    def distance(self, x, y):
+        value = self.field[self.index(x, y)]
+        return None if value >= UNREACHABLE else value + self.offset
+
+    def update(self, x, y):
+        """Переносит источник поля в клетку героя."""
+        i = self.index(x, y)
+        if i == self.source:
+            return
+        if self.source is not None and i - self.source in self.steps:
+            self.shift(i)
+        else:
+            self.compute(i)
+        self.source = i
+
+    def compute(self, source):
+        field = [UNREACHABLE] * len(self.walls)
+        walls = self.walls
+        steps = self.steps
+        field[source] = 0
+        queue = collections.deque([source])
+        while queue:
+            u = queue.popleft()
+            value = field[u] + 1
+            for step in steps:
+                v = u + step
+                if field[v] == UNREACHABLE and not walls[v]:
+                    field[v] = value
+                    queue.append(v)
+        self.field = field
+        self.offset = 0
+
+    def shift(self, source):
+        # Сетка двудольная, поэтому после шага источника на соседнюю
+        # клетку каждое расстояние меняется ровно на 1. Уменьшаются
+        # только клетки, от которых кратчайший путь идёт через новый
+        # источник: они достижимы из него по рёбрам, где старое
+        # расстояние растёт на 1. Их обходит BFS, остальные получают +1
+        # через offset.
+        # На картах почти без стен ближе становится около половины
+        # клеток поля, и тогда shift() лишь примерно вдвое дешевле
+        # compute(): на карте 41x41 это около 0.4 и 0.8 мс на ход.
+        field = self.field
+        steps = self.steps
+        old = field[source]
+        field[source] = old - 2
+        queue = collections.deque([source])
+        while queue:
+            u = queue.popleft()
+            value = field[u] + 3
+            for step in steps:
+                v = u + step
+                if field[v] == value:
+                    field[v] = value - 2
+                    queue.append(v)
+        self.offset += 1
+
+    def downhill(self, x, y):
+        """Соседние клетки, которые ближе к герою, чем (x, y)."""
+        i = self.index(x, y)
+        field = self.field
+        value = field[i]
+        return [self.cell(i + step) for step in self.steps
+                if field[i + step] < value]
+
+
+class EnemyAI:
+    """Ход врагов после каждого хода героя.
+
+    Поле расстояний одно на всех врагов, каждый враг делает шаг вниз по
+    нему, если клетка не занята. Враг, дошедший до героя, вступает в бой
+    так же, как если бы герой наступил на него. На картах из чанков
+    поле строится по окну вокруг героя и перестраивается, когда герой
+    подходит к краю окна.
+    """
+
+    window = 24
+    margin = 8
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.enemies = {}
+        self.map = None
+        self.field = None
+
+    def clone(self, engine):
+        other = EnemyAI(engine)
+        other.enemies = dict(self.enemies)
+        # Поле переходит в копию, иначе первый ход копии - полный BFS
+        if self.field is not None:
+            other.field = self.field.clone()
+            other.map = self.map
+        return other
+
+    def object_added(self, obj):
+        if isinstance(obj, Objects.Enemy):
+            self.enemies[obj] = None
+
+    def object_removed(self, obj):
+        self.enemies.pop(obj, None)
+
+    def object_moved(self, obj, moved):
+        if self.enemies.pop(obj, 0) is None:
+            self.enemies[moved] = None
+
+    def build_field(self, x, y):
+        game_map = self.engine.map
+        if hasattr(game_map, "tiles"):
+            return FlowField(game_map.tiles == TileMap.WALL)
+        r = self.window
+        walls = game_map.region(x - r, y - r, x + r + 1, y + r + 1) == \
+            TileMap.WALL
+        return FlowField(walls, (x - r, y - r), self.margin)
+
+    def window_field(self):
+        x, y = self.engine.hero.position
+        field = self.field
+        if field is None or self.map is not self.engine.map or \
+                not field.inside(x, y):
+            self.map = self.engine.map
+            self.field = field = self.build_field(x, y)
+        return field
+
+    def tick(self):
+        if not self.enemies:
+            return
+        engine = self.engine
+        field = self.window_field()
+        active = [enemy for enemy in self.enemies
+                  if field.inside(*enemy.position)]
+        # Поле пересчитывается, только если в окне есть враги
+        if not active:
+            return
+        field.update(*engine.hero.position)
+        for enemy in active:
+            # Враг мог быть убран боем раньше в этом же ходу
+            if enemy not in self.enemies:
+                continue
+            x, y = enemy.position
+            hero = engine.hero
+            for cell in field.downhill(x, y):
+                if cell == tuple(hero.position):
+                    engine.delete_object(enemy)
+                    enemy.interact(engine, hero)
+                    break
+                if not engine.objects.at(cell):
+                    engine.move_object(enemy, cell)
+                    break
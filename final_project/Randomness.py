@@ -0,0 +1,62 @@
+import random
+import secrets
+import numpy as np
+
+
+def new_seed():
+    # Не из глобального random: после fork у воркеров он одинаковый
+    return secrets.randbits(63)
+
+
+class RandomStreams:
+    """Генераторы случайных чисел движка, по потоку на подсистему.
+
+    Каждый поток выводится из seed движка и своего имени, поэтому
+    расход чисел в одной подсистеме не сдвигает другие, а игра с тем
+    же seed и теми же ходами повторяется в точности.
+    """
+
+    def __init__(self, seed=None):
+        self.seed = new_seed() if seed is None else seed
+        self.streams = {}
+        self.numpy_streams = {}
+
+    def derive(self, name):
+        """Целочисленный seed, выведенный из seed движка и имени."""
+        return random.Random(f"{self.seed}/{name}").getrandbits(63)
+
+    def stream(self, name):
+        rng = self.streams.get(name)
+        if rng is None:
+            rng = self.streams[name] = random.Random(f"{self.seed}/{name}")
+        return rng
+
+    def numpy(self, name):
+        rng = self.numpy_streams.get(name)
+        if rng is None:
+            rng = self.numpy_streams[name] = np.random.default_rng(
+                self.derive(f"numpy/{name}"))
+        return rng
+
+    def spawn(self, index):
+        """Независимый набор потоков, например для index-го воркера."""
+        return RandomStreams(self.derive(f"spawn/{index}"))
+
+    def clone(self):
+        other = RandomStreams(self.seed)
+        other.setstate(self.getstate())
+        return other
+
+    def getstate(self):
+        return {"python": {name: rng.getstate()
+                           for name, rng in self.streams.items()},
+                "numpy": {name: rng.bit_generator.state
+                          for name, rng in self.numpy_streams.items()}}
+
+    def setstate(self, state):
+        self.streams = {}
+        self.numpy_streams = {}
+        for name, rng_state in state["python"].items():
+            self.stream(name).setstate(rng_state)
+        for name, rng_state in state["numpy"].items():
+            self.numpy(name).bit_generator.state = rng_state
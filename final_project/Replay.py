@@ -0,0 +1,152 @@
+import marshal
+import numpy as np
+import Logic
+import Service
+import Simulation
+import Snapshot
+
+VERSION = 1
+
+# Коды ходов совпадают с индексами Simulation.ACTIONS
+MOVES = ((1, 0), (-1, 0), (0, -1), (0, 1))
+MOVE_CODES = {move: code for code, move in enumerate(MOVES)}
+
+
+def pack_moves(codes):
+    # Четыре хода по два бита в байте
+    codes = np.frombuffer(bytes(codes), dtype=np.uint8)
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    padded = padded.reshape(-1, 4)
+    packed = padded[:, 0] | padded[:, 1] << 2 | padded[:, 2] << 4 | \
+        padded[:, 3] << 6
+    return packed.tobytes()
+
+
+def unpack_moves(data, count):
+    packed = np.frombuffer(data, dtype=np.uint8)
+    codes = np.stack([packed & 3, packed >> 2 & 3, packed >> 4 & 3,
+                      packed >> 6], axis=1)
+    return codes.reshape(-1)[:count].tobytes()
+
+
+class Recorder:
+    """Запись игры: seed движка и последовательность ходов героя.
+
+    Движок вызывает record() из move(). Если запись начата не с начала
+    игры (например, после загрузки сохранения), start - снимок
+    Snapshot, с которого начинается повтор.
+    """
+
+    def __init__(self, engine, start=None):
+        self.seed = engine.random.seed
+        self.start = start
+        self.moves = bytearray()
+
+    def record(self, dx, dy):
+        self.moves.append(MOVE_CODES[dx, dy])
+
+    def __len__(self):
+        return len(self.moves)
+
+    def dumps(self):
+        return marshal.dumps((VERSION, self.seed, self.start, len(self.moves),
+                              pack_moves(self.moves)))
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.dumps())
+
+
+def loads(data):
+    """Разбирает запись в (seed, start, ходы)."""
+    data = marshal.loads(data)
+    if data[0] != VERSION:
+        raise ValueError(f"Unsupported replay version: {data[0]}")
+    _, seed, start, count, moves = data
+    return seed, start, unpack_moves(moves, count)
+
+
+def load(path):
+    with open(path, "rb") as file:
+        return loads(file.read())
+
+
+class Replayer:
+    """Повтор записи без отрисовки с перемоткой к любому шагу.
+
+    При проходе вперёд каждые keyframe_interval ходов сохраняется
+    снимок, и seek() повторяет ходы от ближайшего снимка, а не от
+    начала игры.
+    """
+
+    def __init__(self, seed, start, moves, keyframe_interval=1000):
+        self.seed = seed
+        self.start = start
+        self.moves = moves
+        self.keyframe_interval = keyframe_interval
+        self.keyframes = {}
+        self.engine = None
+        self.step = 0
+
+    @classmethod
+    def from_file(cls, path, keyframe_interval=1000):
+        return cls(*load(path), keyframe_interval)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def rewind(self):
+        self.engine = Simulation.create_engine(self.seed)
+        if self.start is not None:
+            Snapshot.restore(self.engine, self.start)
+        self.step = 0
+        self.keyframes[0] = Snapshot.save(self.engine)
+
+    def restore(self, step):
+        engine = Logic.GameEngine(self.seed)
+        engine.levels = Service.LevelPipeline(self.seed, prefetch=False)
+        self.engine = Snapshot.restore(engine, self.keyframes[step])
+        self.step = step
+
+    def seek(self, step):
+        """Движок в состоянии после step ходов записи."""
+        step = max(0, min(step, len(self.moves)))
+        if self.engine is None or not self.step <= step:
+            keyframe = max((key for key in self.keyframes if key <= step),
+                           default=None)
+            if keyframe is None:
+                self.rewind()
+            else:
+                self.restore(keyframe)
+        elif step - self.step > self.keyframe_interval:
+            keyframe = max(key for key in self.keyframes if key <= step)
+            if keyframe > self.step:
+                self.restore(keyframe)
+        self.run(step)
+        return self.engine
+
+    def run(self, until=None, callback=None):
+        """Повторяет ходы до шага until (по умолчанию до конца записи).
+
+        callback(engine, step) вызывается после каждого хода, например
+        для сбора наблюдений.
+        """
+        if self.engine is None:
+            self.rewind()
+        until = len(self.moves) if until is None else until
+        engine = self.engine
+        moves = self.moves
+        interval = self.keyframe_interval
+        step = self.step
+        while step < until:
+            dx, dy = MOVES[moves[step]]
+            engine.move(dx, dy)
+            engine.events.dispatch()
+            step += 1
+            if step % interval == 0 and step not in self.keyframes:
+                self.keyframes[step] = Snapshot.save(engine)
+            if callback is not None:
+                callback(engine, step)
+        self.step = step
+        return engine
@@ -0,0 +1,54 @@
+import collections
+import time
+import pygame
+
+
+class FrameScheduler:
+    """Темп главного цикла: ограничение FPS и перерисовка по требованию.
+
+    В режиме idle цикл засыпает в ожидании событий и перерисовывает
+    экран только после ввода или явного invalidate().
+
+    Цепочка ScreenHandle выводит поверхности на экран до того, как они
+    перерисуют себя, поэтому новое состояние видно со следующего кадра.
+    Каждый запрос перерисовки даёт два кадра.
+    """
+
+    redraw_frames = 2
+
+    def __init__(self, fps=60, idle=True, history=240):
+        self.fps = fps
+        self.idle = idle
+        self.clock = pygame.time.Clock()
+        self.pending = self.redraw_frames
+        self.frame_times = collections.deque(maxlen=history)
+        self.frame_start = None
+
+    def get_events(self):
+        if self.idle and not self.dirty:
+            events = [pygame.event.wait()]
+            events.extend(pygame.event.get())
+        else:
+            events = pygame.event.get()
+        for event in events:
+            if event.type != pygame.MOUSEMOTION:
+                self.invalidate()
+        return events
+
+    @property
+    def dirty(self):
+        return self.pending > 0
+
+    def invalidate(self):
+        self.pending = self.redraw_frames
+
+    def begin_frame(self):
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        self.frame_times.append(time.perf_counter() - self.frame_start)
+        self.pending -= 1
+
+    def tick(self):
+        # Пауза до следующего кадра, чтобы не превышать fps
+        self.clock.tick(self.fps)
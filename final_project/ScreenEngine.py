@@ -1,5 +1,10 @@
 import pygame
 import collections
+import functools
+import numpy as np
+import Events
+import Objects
+import TileMap
 
 colors = {
     "black": (0, 0, 0, 255),
@@ -10,6 +15,35 @@ colors = {
     "wooden": (153, 92, 0, 255),
 }
 
+fonts = {}
+
+
+def get_font(name, size):
+    # SysFont ищет шрифт в системе, поэтому каждый шрифт создаётся один раз
+    key = (name, size)
+    if key not in fonts:
+        fonts[key] = pygame.font.SysFont(name, size)
+    return fonts[key]
+
+
+@functools.lru_cache(maxsize=512)
+def render_text(font, text, color):
+    """Отрисованный текст; font - пара (имя, размер) для get_font.
+
+    Неизменившиеся надписи между кадрами берутся из кэша.
+    """
+    return get_font(*font).render(text, True, color)
+
+
+def row_runs(mask):
+    """Отрезки True в строках mask: тройки (строка, начало, конец)."""
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    steps = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(steps == 1)
+    ends = np.nonzero(steps == -1)[1]
+    return zip(rows.tolist(), starts.tolist(), ends.tolist())
+
 
 class ScreenHandle(pygame.Surface):
 
@@ -40,62 +74,212 @@ class GameSurface(ScreenHandle):
     def connect_engine(self, engine):
         # FIXME save engine and send it to next in chain
         self.game_engine = engine
+        self.blocks = collections.OrderedDict()
+        self.background_map = None
+        self.view = None
+        self.drawn = {}
+        self.scene = None
+        self.objects_version = 0
+        self.drawn_objects = None
+        engine.fov.tracking = True
+        engine.watch_objects(self)
         super().connect_engine(engine)
 
+    def object_added(self, obj):
+        self.objects_version += 1
+
+    def object_removed(self, obj):
+        self.objects_version += 1
+
+    def object_moved(self, obj, moved):
+        self.objects_version += 1
+
+    # Рельеф рисуется в кэш блоками block_cells x block_cells клеток: для
+    # обычного уровня это несколько блоков на весь уровень, для большой
+    # карты в кэше только блоки вокруг видимой области
+    block_cells = 32
+
+    def reset_background(self):
+        self.blocks.clear()
+        self.background_map = self.game_engine.map
+        self.background_size = self.game_engine.sprite_size
+        self.view = None
+        self.scene = None
+        # Неисследованные клетки переносятся из чёрной поверхности: на
+        # поверхность с альфа-каналом это быстрее, чем fill()
+        self.black = pygame.Surface(self.get_size())
+        self.black.fill(colors["black"])
+
+    def block(self, bx, by, fogged=False):
+        key = (bx, by, fogged)
+        surface = self.blocks.get(key)
+        if surface is not None:
+            self.blocks.move_to_end(key)
+            return surface
+        if fogged:
+            # Рельеф под туманом - копия блока, затемнённая один раз
+            surface = self.block(bx, by).copy()
+            fog = pygame.Surface(surface.get_size(), pygame.SRCALPHA)
+            fog.fill((0, 0, 0, 140))
+            surface.blit(fog, (0, 0))
+            return self.cache_block(key, surface)
+        game_map = self.game_engine.map
+        size = self.game_engine.sprite_size
+        cells = self.block_cells
+        x0, y0 = bx * cells, by * cells
+        tiles = game_map.region(x0, y0, min(x0 + cells, game_map.width),
+                                min(y0 + cells, game_map.height))
+        surface = pygame.Surface((tiles.shape[1] * size, tiles.shape[0] * size))
+        palette = game_map.palette
+        for y, row in enumerate(tiles.tolist()):
+            for x, tile in enumerate(row):
+                surface.blit(palette[tile][0], (x * size, y * size))
+        return self.cache_block(key, surface)
+
+    def cache_block(self, key, surface):
+        self.blocks[key] = surface
+        # Держим в кэше вчетверо больше блоков каждого вида, чем
+        # помещается на экран
+        cells = self.block_cells * self.game_engine.sprite_size
+        visible = (self.get_width() // cells + 2) * \
+            (self.get_height() // cells + 2)
+        while len(self.blocks) > max(32, 8 * visible):
+            self.blocks.popitem(last=False)
+        return surface
+
+    def blit_terrain(self, x, y, width, height, fogged=False):
+        """Переносит из кэша рельеф клеток [x, x + width) x [y, y + height).
+
+        fogged - рельеф под туманом, для исследованных невидимых клеток.
+        """
+        game_map = self.game_engine.map
+        size = self.game_engine.sprite_size
+        cells = self.block_cells
+        x1, y1 = min(x + width, game_map.width), min(y + height, game_map.height)
+        x, y = max(x, 0), max(y, 0)
+        if x >= x1 or y >= y1:
+            return
+        for by in range(y // cells, (y1 - 1) // cells + 1):
+            for bx in range(x // cells, (x1 - 1) // cells + 1):
+                surface = self.block(bx, by, fogged)
+                ax0, ay0 = max(x, bx * cells), max(y, by * cells)
+                ax1, ay1 = min(x1, (bx + 1) * cells), min(y1, (by + 1) * cells)
+                self.blit(surface,
+                          ((ax0 - self.min_x) * size, (ay0 - self.min_y) * size),
+                          ((ax0 - bx * cells) * size, (ay0 - by * cells) * size,
+                           (ax1 - ax0) * size, (ay1 - ay0) * size))
+
     def draw_hero(self):
-        self.game_engine.hero.draw(self)
+        hero = self.game_engine.hero
+        self.draw_object(hero.sprite, hero.position)
 
     def draw_map(self):
 
         screen_width = self.get_width() // self.game_engine.sprite_size
         screen_height = self.get_height() // self.game_engine.sprite_size
-        
+
         hero_x, hero_y = self.game_engine.hero.position
-        
+
         # Center on hero
         min_x = max(0, hero_x - screen_width // 2)
         min_y = max(0, hero_y - screen_height // 2)
-        
+
         # Adjust if near edge
-        if min_x + screen_width > len(self.game_engine.map[0]):
-            min_x = len(self.game_engine.map[0]) - screen_width
-        if min_y + screen_height > len(self.game_engine.map):
-            min_y = len(self.game_engine.map) - screen_height
-        
+        if min_x + screen_width > self.game_engine.map.width:
+            min_x = self.game_engine.map.width - screen_width
+        if min_y + screen_height > self.game_engine.map.height:
+            min_y = self.game_engine.map.height - screen_height
+
         min_x = max(0, min_x)
         min_y = max(0, min_y)
-        
+
         self.min_x = min_x
         self.min_y = min_y
 
-        if self.game_engine.map:
-            for i in range(len(self.game_engine.map[0]) - min_x):
-                for j in range(len(self.game_engine.map) - min_y):
-                    self.blit(self.game_engine.map[min_y + j][min_x + i][
-                              0], (i * self.game_engine.sprite_size, j * self.game_engine.sprite_size))
-        else:
-            self.fill(colors["white"])
+        if self.background_map is not self.game_engine.map or \
+                self.background_size != self.game_engine.sprite_size:
+            self.reset_background()
+
+        self.view = (min_x, min_y)
+
+    def draw_fog(self):
+        """Рисует рельеф всего вида с туманом войны.
+
+        Весь вид переносится из кэша рельефа под туманом, затем по
+        отрезкам строк неисследованные клетки закрываются чёрным, а
+        видимые получают рельеф без тумана.
+        """
+        fov = self.game_engine.fov
+        size = self.game_engine.sprite_size
+        min_x, min_y = self.min_x, self.min_y
+        cells_x = self.get_width() // size + 1
+        cells_y = self.get_height() // size + 1
+        self.blit_terrain(min_x, min_y, cells_x, cells_y, fogged=True)
+
+        explored = fov.explored.region(min_x, min_y, min_x + cells_x,
+                                       min_y + cells_y)
+        for y, x0, x1 in row_runs(~explored):
+            self.blit(self.black, (x0 * size, y * size),
+                      (0, 0, (x1 - x0) * size, size))
+        origin_x, origin_y = fov.origin
+        for y, x0, x1 in row_runs(fov.visible):
+            self.blit_terrain(origin_x + x0, origin_y + y, x1 - x0, 1)
+
+    def draw_tile(self, coord):
+        self.blit_terrain(coord[0], coord[1], 1, 1)
 
     def draw_object(self, sprite, coord):
         size = self.game_engine.sprite_size
         self.blit(sprite, ((coord[0] - self.min_x) * size,
-                          (coord[1] - self.min_y) * size))
+                           (coord[1] - self.min_y) * size))
 
     def draw(self, canvas):
-        size = self.game_engine.sprite_size
-        
-        if not hasattr(self, 'min_x'):
-            self.min_x = 0
-            self.min_y = 0
-            
+        if not self.game_engine.map:
+            self.fill(colors["white"])
+            super().draw(canvas)
+            return
+
         self.draw_map()
-        
-        for obj in self.game_engine.objects:
-            self.blit(obj.sprite[0], 
-                     ((obj.position[0] - self.min_x) * size,
-                      (obj.position[1] - self.min_y) * size))
-        
-        self.draw_hero()
+
+        # Вид, обзор и объекты не менялись - кадр уже нарисован
+        engine = self.game_engine
+        fov = engine.fov
+        fov.update()
+        scene = (self.view, fov.key, fov.version)
+        if scene == self.scene and self.objects_version == self.drawn_objects:
+            super().draw(canvas)
+            return
+
+        # Спрайты видимых клеток, герой поверх объектов
+        cells = {}
+        origin_x, origin_y = fov.origin
+        ys, xs = np.nonzero(fov.visible)
+        for y, x in zip(ys.tolist(), xs.tolist()):
+            objects = engine.objects.at((origin_x + x, origin_y + y))
+            if objects:
+                cells[(origin_x + x, origin_y + y)] = objects[-1].sprite[0]
+        hero = engine.hero
+        cells[tuple(hero.position)] = hero.sprite
+
+        if scene != self.scene:
+            # Сдвиг вида или обзора: рельеф вида целиком, поверх - спрайты
+            self.draw_fog()
+            for coord, sprite in cells.items():
+                self.draw_object(sprite, coord)
+        else:
+            # Сдвинулись только объекты, а они все в видимых клетках:
+            # перерисовываются клетки, где спрайт изменился
+            for coord in self.drawn.keys() | cells.keys():
+                sprite = cells.get(coord)
+                if self.drawn.get(coord) is sprite:
+                    continue
+                self.draw_tile(coord)
+                if sprite is not None:
+                    self.draw_object(sprite, coord)
+        self.scene = scene
+        self.drawn_objects = self.objects_version
+        self.drawn = cells
+
         super().draw(canvas)
 
 
@@ -119,46 +303,46 @@ class ProgressBar(ScreenHandle):
         pygame.draw.rect(self, colors["green"], (50, 70,
                                                  200 * self.engine.hero.exp / (100 * (2**(self.engine.hero.level - 1))), 30))
 
-        font = pygame.font.SysFont("comicsansms", 20)
-        self.blit(font.render(f'Hero at {self.engine.hero.position}', True, colors["black"]),
+        font = ("comicsansms", 20)
+        self.blit(render_text(font, f'Hero at {self.engine.hero.position}', colors["black"]),
                   (250, 0))
 
-        self.blit(font.render(f'{self.engine.level} floor', True, colors["black"]),
+        self.blit(render_text(font, f'{self.engine.level} floor', colors["black"]),
                   (10, 0))
 
-        self.blit(font.render(f'HP', True, colors["black"]),
+        self.blit(render_text(font, f'HP', colors["black"]),
                   (10, 30))
-        self.blit(font.render(f'Exp', True, colors["black"]),
+        self.blit(render_text(font, f'Exp', colors["black"]),
                   (10, 70))
 
-        self.blit(font.render(f'{self.engine.hero.hp}/{self.engine.hero.max_hp}', True, colors["black"]),
+        self.blit(render_text(font, f'{self.engine.hero.hp}/{self.engine.hero.max_hp}', colors["black"]),
                   (60, 30))
-        self.blit(font.render(f'{self.engine.hero.exp}/{(100*(2**(self.engine.hero.level-1)))}', True, colors["black"]),
+        self.blit(render_text(font, f'{self.engine.hero.exp}/{(100*(2**(self.engine.hero.level-1)))}', colors["black"]),
                   (60, 70))
 
-        self.blit(font.render(f'Level', True, colors["black"]),
+        self.blit(render_text(font, f'Level', colors["black"]),
                   (300, 30))
-        self.blit(font.render(f'Gold', True, colors["black"]),
+        self.blit(render_text(font, f'Gold', colors["black"]),
                   (300, 70))
 
-        self.blit(font.render(f'{self.engine.hero.level}', True, colors["black"]),
+        self.blit(render_text(font, f'{self.engine.hero.level}', colors["black"]),
                   (360, 30))
-        self.blit(font.render(f'{self.engine.hero.gold}', True, colors["black"]),
+        self.blit(render_text(font, f'{self.engine.hero.gold}', colors["black"]),
                   (360, 70))
 
-        self.blit(font.render(f'Str', True, colors["black"]),
+        self.blit(render_text(font, f'Str', colors["black"]),
                   (420, 30))
-        self.blit(font.render(f'Luck', True, colors["black"]),
+        self.blit(render_text(font, f'Luck', colors["black"]),
                   (420, 70))
 
-        self.blit(font.render(f'{self.engine.hero.stats["strength"]}', True, colors["black"]),
+        self.blit(render_text(font, f'{self.engine.hero.stats["strength"]}', colors["black"]),
                   (480, 30))
-        self.blit(font.render(f'{self.engine.hero.stats["luck"]}', True, colors["black"]),
+        self.blit(render_text(font, f'{self.engine.hero.stats["luck"]}', colors["black"]),
                   (480, 70))
 
-        self.blit(font.render(f'SCORE', True, colors["black"]),
+        self.blit(render_text(font, f'SCORE', colors["black"]),
                   (550, 30))
-        self.blit(font.render(f'{self.engine.score:.4f}', True, colors["black"]),
+        self.blit(render_text(font, f'{self.engine.score:.4f}', colors["black"]),
                   (550, 70))
 
         # draw next surface in chain
@@ -173,16 +357,18 @@ class InfoWindow(ScreenHandle):
         clear = []
         self.data = collections.deque(clear, maxlen=self.len)
 
-    def update(self, value):
-        self.data.append(f"> {str(value)}")
+    def update_batch(self, events):
+        # Хранятся записи, текст строится только для показанных строк
+        self.data.extend(events)
 
     def draw(self, canvas):
         self.fill(colors["wooden"])
         size = self.get_size()
 
-        font = pygame.font.SysFont("comicsansms", 10)
-        for i, text in enumerate(self.data):
-            self.blit(font.render(text, True, colors["black"]),
+        font = ("comicsansms", 10)
+        for i, event in enumerate(self.data):
+            text = f"> {Events.format_event(event)}"
+            self.blit(render_text(font, text, colors["black"]),
                       (5, 20 + 18 * i))
 
         # FIXME
@@ -193,7 +379,7 @@ class InfoWindow(ScreenHandle):
         # FIXME set this class as Observer to engine and send it to next in
         # chain
         self.engine = engine
-        engine.subscribe(self)
+        engine.subscribe(self, Events.FORMATS)
         super().connect_engine(engine)
 
 
@@ -212,8 +398,11 @@ class HelpWindow(ScreenHandle):
         self.data.append(["Num+", "Zoom +"])
         self.data.append(["Num-", "Zoom -"])
         self.data.append([" R ", "Restart Game"])
+        self.data.append([" F5 ", "Quick Save"])
+        self.data.append([" F9 ", "Quick Load"])
         # FIXME You can add some help information
         self.data.append([" M ", "Show/Hide Minimap"])
+        self.data.append([" F ", "Frame Times"])
         self.data.append(["", ""])
         self.data.append(["Collect gold and XP"])
         self.data.append(["Avoid enemies or fight"])
@@ -230,69 +419,162 @@ class HelpWindow(ScreenHandle):
             alpha = 128
         self.fill((0, 0, 0, alpha))
         size = self.get_size()
-        font1 = pygame.font.SysFont("courier", 24)
-        font2 = pygame.font.SysFont("serif", 24)
+        font1 = ("courier", 24)
+        font2 = ("serif", 24)
         if self.engine.show_help:
             pygame.draw.lines(self, (255, 0, 0, 255), True, [
                               (0, 0), (700, 0), (700, 500), (0, 500)], 5)
             for i, text in enumerate(self.data):
-                self.blit(font1.render(text[0], True, ((128, 128, 255))),
+                self.blit(render_text(font1, text[0], ((128, 128, 255))),
                           (50, 50 + 30 * i))
-                self.blit(font2.render(text[1], True, ((128, 128, 255))),
-                          (150, 50 + 30 * i))
+                if len(text) > 1:
+                    self.blit(render_text(font2, text[1], ((128, 128, 255))),
+                              (150, 50 + 30 * i))
         # FIXME
         # draw next surface in chain
         super().draw(canvas)
 
 
+class FrameTimeWindow(ScreenHandle):
+    """Гистограмма времени отрисовки последних кадров."""
+
+    bins = 16
+    bin_ms = 2
+
+    def connect_engine(self, engine):
+        self.engine = engine
+        super().connect_engine(engine)
+
+    def draw(self, canvas):
+        self.fill((0, 0, 0, 0))
+        frame_times = getattr(self.engine, "frame_times", None)
+        if self.engine.show_frame_times and frame_times:
+            self.fill((0, 0, 0, 160))
+            counts = [0] * self.bins
+            for seconds in frame_times:
+                counts[min(self.bins - 1, int(seconds * 1000 / self.bin_ms))] += 1
+            width, height = self.get_size()
+            bar = (width - 10) // self.bins
+            top = max(counts)
+            for i, count in enumerate(counts):
+                bar_height = (height - 30) * count // top
+                pygame.draw.rect(self, colors["green"],
+                                 (5 + i * bar, height - 5 - bar_height,
+                                  bar - 1, bar_height))
+            average = sum(frame_times) / len(frame_times) * 1000
+            self.blit(render_text(("courier", 14),
+                                  f"frame {average:.2f} ms, {self.bin_ms} ms/bin",
+                                  colors["white"]), (5, 5))
+        super().draw(canvas)
+
+
 class MinimapWindow(ScreenHandle):
+    """Миникарта уровня.
+
+    Рельеф рисуется один раз на уровень в кэш-поверхность; большие карты
+    прореживаются с шагом step, а карты из чанков показываются окном
+    вокруг героя, которое перерисовывается, только когда герой подходит
+    к его краю. На миникарте только исследованные клетки, слой
+    перестраивается при открытии новых. Каждый кадр поверх кэша рисуются
+    лишь герой и видимые враги, а позиции врагов ведутся по событиям
+    движка.
+    """
+
+    cells = 150
+    margin = 25
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.show_minimap = True
 
     def connect_engine(self, engine):
         self.engine = engine
+        self.layer_map = None
+        self.enemies = {}
+        engine.watch_objects(self)
         super().connect_engine(engine)
 
+    def object_added(self, obj):
+        if isinstance(obj, Objects.Enemy):
+            self.enemies[obj] = tuple(obj.position)
+
+    def object_removed(self, obj):
+        self.enemies.pop(obj, None)
+
+    def object_moved(self, obj, moved):
+        if self.enemies.pop(obj, None) is not None:
+            self.enemies[moved] = tuple(moved.position)
+
+    def update_layer(self):
+        game_map = self.engine.map
+        hero_x, hero_y = self.engine.hero.position
+        fov = self.engine.fov
+        fov.update()
+        if self.layer_map is not game_map:
+            self.layer_map = game_map
+            self.origin = None
+            self.layer_version = None
+            self.enemies = {obj: tuple(obj.position)
+                            for obj in self.engine.objects
+                            if isinstance(obj, Objects.Enemy)}
+            if hasattr(game_map, "tiles"):
+                self.step = -(-max(game_map.width, game_map.height) // self.cells)
+                self.window = None
+            else:
+                self.step = 1
+                self.window = (min(game_map.width, self.cells),
+                               min(game_map.height, self.cells))
+
+        if self.window is None:
+            origin = (0, 0)
+            cells_x = -(-game_map.width // self.step)
+            cells_y = -(-game_map.height // self.step)
+        else:
+            cells_x, cells_y = self.window
+            origin = self.origin
+            if origin is None or not (
+                    origin[0] + self.margin <= hero_x < origin[0] + cells_x - self.margin and
+                    origin[1] + self.margin <= hero_y < origin[1] + cells_y - self.margin):
+                origin = (min(max(0, hero_x - cells_x // 2), game_map.width - cells_x),
+                          min(max(0, hero_y - cells_y // 2), game_map.height - cells_y))
+        if origin == self.origin and fov.version == self.layer_version:
+            return
+
+        self.origin = origin
+        self.layer_version = fov.version
+        self.cell_size = max(1, self.cells // max(cells_x, cells_y))
+        x0, y0 = origin
+        x1, y1 = x0 + cells_x * self.step, y0 + cells_y * self.step
+        tiles = game_map.region(x0, y0, x1, y1)[::self.step, ::self.step]
+        explored = fov.explored.region(x0, y0, x1, y1)[::self.step, ::self.step]
+        shade = np.where(tiles == TileMap.WALL, 50, 100).astype(np.uint8)
+        shade[~explored] = 0
+        rgb = np.repeat(shade.T[:, :, None], 3, axis=2)
+        self.layer = pygame.transform.scale(
+            pygame.surfarray.make_surface(rgb),
+            (cells_x * self.cell_size, cells_y * self.cell_size))
+
+    def draw_marker(self, position, color):
+        x = (position[0] - self.origin[0]) // self.step
+        y = (position[1] - self.origin[1]) // self.step
+        width, height = self.layer.get_size()
+        size = self.cell_size
+        if 0 <= x * size < width and 0 <= y * size < height:
+            pygame.draw.rect(self, color, (5 + x * size, 5 + y * size, size, size))
+
     def draw(self, canvas):
         if self.engine.show_minimap and self.engine.map:
             self.fill((0, 0, 0, 150))
-            
-            # Draw minimap border
-            pygame.draw.rect(self, (255, 255, 255), (5, 5, 152, 152), 2)
-            
-            # Calculate minimap scale
-            map_width = len(self.engine.map[0])
-            map_height = len(self.engine.map)
-            
-            if map_width > 0 and map_height > 0:
-                cell_size = min(150 // map_width, 150 // map_height)
-                
-                # Draw map tiles
-                for y in range(min(map_height, 150 // cell_size)):
-                    for x in range(min(map_width, 150 // cell_size)):
-                        tile = self.engine.map[y][x][0]
-                        color = (100, 100, 100)
-                        if tile == wall[0]:
-                            color = (50, 50, 50)
-                        
-                        pygame.draw.rect(self, color, 
-                                        (5 + x * cell_size, 5 + y * cell_size, 
-                                         cell_size, cell_size))
-                
-                # Draw hero position
-                hero_x, hero_y = self.engine.hero.position
-                if hero_x < map_width and hero_y < map_height:
-                    pygame.draw.rect(self, (255, 0, 0),
-                                   (5 + hero_x * cell_size, 5 + hero_y * cell_size,
-                                    cell_size, cell_size))
-                
-                # Draw enemies
-                for obj in self.engine.objects:
-                    if isinstance(obj, Objects.Enemy):
-                        obj_x, obj_y = obj.position
-                        pygame.draw.rect(self, (0, 0, 255),
-                                       (5 + obj_x * cell_size, 5 + obj_y * cell_size,
-                                        cell_size, cell_size))
-        
+            self.update_layer()
+            self.blit(self.layer, (5, 5))
+            pygame.draw.rect(self, (255, 255, 255), (3, 3, 154, 154), 2)
+
+            fov = self.engine.fov
+            for position in self.enemies.values():
+                if fov.is_visible(*position):
+                    self.draw_marker(position, (0, 0, 255))
+            self.draw_marker(self.engine.hero.position, (255, 0, 0))
+        else:
+            self.fill((0, 0, 0, 0))
+
         super().draw(canvas)
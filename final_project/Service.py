@@ -1,39 +1,90 @@
-import pygame
+import copy
 import random
 import yaml
 import os
+from concurrent.futures import ThreadPoolExecutor
+import Events
 import Objects
+import Randomness
+import Textures
+import TileMap
 
-OBJECT_TEXTURE = os.path.join("texture", "objects")
-ENEMY_TEXTURE = os.path.join("texture", "enemies")
-ALLY_TEXTURE = os.path.join("texture", "ally")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEXTURE = os.path.join(BASE_DIR, "texture")
+OBJECT_TEXTURE = os.path.join(TEXTURE, "objects")
+ENEMY_TEXTURE = os.path.join(TEXTURE, "enemies")
+ALLY_TEXTURE = os.path.join(TEXTURE, "ally")
+
+# В headless-режиме окно не создаётся и картинки не декодируются
+HEADLESS = False
+
+textures = Textures.TextureManager()
+object_list_src = None
 
 
 def create_sprite(img, sprite_size):
-    icon = pygame.image.load(img).convert_alpha()
-    icon = pygame.transform.scale(icon, (sprite_size, sprite_size))
-    sprite = pygame.Surface((sprite_size, sprite_size), pygame.HWSURFACE)
-    sprite.blit(icon, (0, 0))
-    return sprite
+    if HEADLESS:
+        # Заглушка вместо спрайта: стены и пол различаются по идентичности
+        # спрайта, поэтому у каждой текстуры своя строка
+        return os.path.basename(img)
+    return textures.sprite(img, sprite_size)
 
 
 def reload_game(engine, hero):
-    global level_list
-    level_list_max = len(level_list) - 1
     engine.level += 1
     hero.position = [1, 1]
-    engine.objects = []
-    generator = level_list[min(engine.level, level_list_max)]
-    _map = generator['map'].get_map()
+    engine.clear_objects()
+    if engine.levels is None:
+        engine.levels = LevelPipeline(engine.random.seed)
+    _map, objects = engine.levels.get(engine.level)
     engine.load_map(_map)
-    engine.add_objects(generator['obj'].get_objects(_map))
+    engine.add_objects(objects)
     engine.add_hero(hero)
 
 
+prefetch_executor = None
+
+
+class LevelPipeline:
+    """Генерация уровней с предзагрузкой следующего этажа в фоне.
+
+    У каждого уровня свой seed, выведенный из seed игры, поэтому уровень,
+    построенный заранее, совпадает с построенным по требованию.
+    """
+
+    def __init__(self, seed=None, prefetch=True):
+        self.seed = Randomness.new_seed() if seed is None else seed
+        self.prefetch_enabled = prefetch
+        self.pending = {}
+
+    def level_seed(self, level):
+        return f"{self.seed}/{level}"
+
+    def generate(self, level):
+        rng = random.Random(self.level_seed(level))
+        generator = level_list[min(level, len(level_list) - 1)]
+        _map = generator['map'].get_map(rng)
+        return _map, generator['obj'].get_objects(_map, rng)
+
+    def get(self, level):
+        future = self.pending.pop(level, None)
+        result = future.result() if future else self.generate(level)
+        self.prefetch(level + 1)
+        return result
+
+    def prefetch(self, level):
+        global prefetch_executor
+        if not self.prefetch_enabled or level in self.pending:
+            return
+        if prefetch_executor is None:
+            prefetch_executor = ThreadPoolExecutor(max_workers=1)
+        self.pending[level] = prefetch_executor.submit(self.generate, level)
+
+
 def restore_hp(engine, hero):
     engine.score += 0.1
     hero.hp = hero.max_hp
-    engine.notify("HP restored")
+    engine.emit(Events.HP_RESTORED)
 
 
 def apply_blessing(engine, hero):
@@ -41,12 +92,12 @@ def apply_blessing(engine, hero):
         engine.score += 0.2
         hero.gold -= int(20 * 1.5**engine.level) - \
             2 * hero.stats["intelligence"]
-        if random.randint(0, 1) == 0:
-            engine.hero = Objects.Blessing(hero)
-            engine.notify("Blessing applied")
+        if engine.random.stream("actions").randint(0, 1) == 0:
+            hero.add_effect(Objects.Blessing())
+            engine.emit(Events.EFFECT_APPLIED, effect="Blessing")
         else:
-            engine.hero = Objects.Berserk(hero)
-            engine.notify("Berserk applied")
+            hero.add_effect(Objects.Berserk())
+            engine.emit(Events.EFFECT_APPLIED, effect="Berserk")
     else:
         engine.score -= 0.1
 
@@ -58,30 +109,84 @@ def apply_power(engine, hero):
     if hero.gold >= cost:
         engine.score += 0.1
         hero.gold -= cost
-        engine.hero = Objects.Power(hero)
-        engine.notify(f"Power applied! Strength +7 (Cost: {cost} gold)")
+        hero.add_effect(Objects.Power())
+        engine.emit(Events.POWER, cost=cost)
     else:
-        engine.notify(f"Not enough gold! Need {cost} gold for power.")
+        engine.emit(Events.NOT_ENOUGH_GOLD, cost=cost)
 
 def remove_effect(engine, hero):
-    if hero.gold >= int(10 * 1.5**engine.level) - 2 * hero.stats["intelligence"] and "base" in dir(hero):
+    if hero.gold >= int(10 * 1.5**engine.level) - 2 * hero.stats["intelligence"] and hero.effects:
         hero.gold -= int(10 * 1.5**engine.level) - \
             2 * hero.stats["intelligence"]
-        engine.hero = hero.base
-        engine.hero.calc_max_HP()
-        engine.notify("Effect removed")
+        hero.remove_effect()
+        engine.emit(Events.EFFECT_REMOVED)
 
 
 def add_gold(engine, hero):
-    if random.randint(1, 10) == 1:
+    rng = engine.random.stream("actions")
+    if rng.randint(1, 10) == 1:
         engine.score -= 0.05
-        engine.hero = Objects.Weakness(hero)
-        engine.notify("You were cursed")
+        hero.add_effect(Objects.Weakness())
+        engine.emit(Events.CURSED)
     else:
         engine.score += 0.1
-        gold = int(random.randint(10, 1000) * (1.1**(engine.hero.level - 1)))
+        gold = int(rng.randint(10, 1000) * (1.1**(engine.hero.level - 1)))
         hero.gold += gold
-        engine.notify(f"{gold} gold added")
+        engine.emit(Events.GOLD, amount=gold)
+
+
+class PlacementError(ValueError):
+    pass
+
+
+class FreeCells:
+    """Свободные клетки пола для расстановки объектов.
+
+    Клетки выбираются случайно без возвращения, поэтому расстановка
+    занимает O(1) на объект и всегда завершается: если клеток не
+    хватает, выбрасывается PlacementError. Берутся только клетки,
+    достижимые из start, где появляется герой.
+    """
+
+    def __init__(self, _map, rng=random, reserved=((1, 1),), start=(1, 1)):
+        self.rng = rng
+        reserved = set(reserved)
+        self.cells = [cell for cell in _map.floor_cells(start)
+                      if cell not in reserved]
+
+    def __len__(self):
+        return len(self.cells)
+
+    def take(self):
+        if not self.cells:
+            raise PlacementError("No free floor cells left, the level is too full")
+        i = self.rng.randrange(len(self.cells))
+        self.cells[i], self.cells[-1] = self.cells[-1], self.cells[i]
+        return self.cells.pop()
+
+
+class SparseCells:
+    """Свободные клетки большой карты без обхода всей карты.
+
+    Клетка выбирается случайно и проверяется на стену; число попыток
+    ограничено, после них выбрасывается PlacementError.
+    """
+
+    attempts = 1000
+
+    def __init__(self, _map, rng=random, reserved=((1, 1),)):
+        self.map = _map
+        self.rng = rng
+        self.taken = set(reserved)
+
+    def take(self):
+        for _ in range(self.attempts):
+            cell = (self.rng.randrange(1, self.map.width - 1),
+                    self.rng.randrange(1, self.map.height - 1))
+            if cell not in self.taken and not self.map.is_wall(*cell):
+                self.taken.add(cell)
+                return cell
+        raise PlacementError("No free floor cell found, the level is too full")
 
 
 class MapFactory(yaml.YAMLObject):
@@ -115,19 +220,16 @@ class EndMap(MapFactory):
                         '0                                     0',
                         '000000000000000000000000000000000000000'
                         ]
-            self.Map = list(map(list, self.Map))
-            for i in self.Map:
-                for j in range(len(i)):
-                    i[j] = wall if i[j] == '0' else floor1
+            self.Map = TileMap.TileMap.from_strings(self.Map, palette)
          
-        def get_map(self):
+        def get_map(self, rng=random):
             return self.Map
 
     class Objects:
         def __init__(self):
             self.objects = []
 
-        def get_objects(self, _map):
+        def get_objects(self, _map, rng=random):
             return self.objects
 
 
@@ -136,89 +238,50 @@ class RandomMap(MapFactory):
 
     class Map:
 
-        def __init__(self):
-            self.Map = [[0 for _ in range(41)] for _ in range(41)]
-            for i in range(41):
-                for j in range(41):
-                    if i == 0 or j == 0 or i == 40 or j == 40:
-                        self.Map[j][i] = wall
-                    else:
-                        self.Map[j][i] = [wall, floor1, floor2, floor3, floor1,
-                                          floor2, floor3, floor1, floor2][random.randint(0, 8)]
-
-        def get_map(self):
-            return self.Map
+        attempts = 10
+
+        def get_map(self, rng=random):
+            # Если герой заперт в небольшом кармане, объектам не хватит
+            # достижимых клеток: такая карта строится заново, а после
+            # attempts попыток карман соединяется коридором с остальной
+            # картой. Область героя остаётся в карте для FreeCells.
+            for _ in range(self.attempts):
+                _map = TileMap.TileMap.random(
+                    rng, 41, 41, [TileMap.WALL, TileMap.FLOOR1, TileMap.FLOOR2,
+                                  TileMap.FLOOR3, TileMap.FLOOR1, TileMap.FLOOR2,
+                                  TileMap.FLOOR3, TileMap.FLOOR1, TileMap.FLOOR2],
+                    palette)
+                region = _map.start_region((1, 1))
+                if 2 * region.sum() >= (_map.tiles != TileMap.WALL).sum():
+                    return _map
+            _map.connect((1, 1))
+            return _map
 
     class Objects:
 
-        def __init__(self):
-            self.objects = []
-
-        def get_objects(self, _map):
+        def get_objects(self, _map, rng=random):
+            cells = FreeCells(_map, rng)
+            objects = []
 
             for obj_name in object_list_prob['objects']:
                 prop = object_list_prob['objects'][obj_name]
-                for i in range(random.randint(prop['min-count'], prop['max-count'])):
-                    coord = (random.randint(1, 39), random.randint(1, 39))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39),
-                                     random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39),
-                                         random.randint(1, 39))
-
-                    self.objects.append(Objects.Ally(
-                        prop['sprite'], prop['action'], coord))
+                for i in range(rng.randint(prop['min-count'], prop['max-count'])):
+                    objects.append(Objects.Ally(
+                        prop['sprite'], prop['action'], cells.take()))
 
             for obj_name in object_list_prob['ally']:
                 prop = object_list_prob['ally'][obj_name]
-                for i in range(random.randint(prop['min-count'], prop['max-count'])):
-                    coord = (random.randint(1, 39), random.randint(1, 39))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39),
-                                     random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39),
-                                         random.randint(1, 39))
-                    self.objects.append(Objects.Ally(
-                        prop['sprite'], prop['action'], coord))
+                for i in range(rng.randint(prop['min-count'], prop['max-count'])):
+                    objects.append(Objects.Ally(
+                        prop['sprite'], prop['action'], cells.take()))
 
             for obj_name in object_list_prob['enemies']:
                 prop = object_list_prob['enemies'][obj_name]
-                for i in range(random.randint(0, 5)):
-                    coord = (random.randint(1, 30), random.randint(1, 22))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39),
-                                     random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39),
-                                         random.randint(1, 39))
-
-                    self.objects.append(Objects.Enemy(
-                        prop['sprite'], prop, prop['experience'], coord))
+                for i in range(rng.randint(0, 5)):
+                    objects.append(Objects.Enemy(
+                        prop['sprite'], prop, prop['experience'], cells.take()))
 
-            return self.objects
+            return objects
 
 
 # FIXME
@@ -241,19 +304,16 @@ class EmptyMap(MapFactory):
                         '0                                     0',
                         '000000000000000000000000000000000000000'
                         ]
-            self.Map = list(map(list, self.Map))
-            for i in self.Map:
-                for j in range(len(i)):
-                    i[j] = wall if i[j] == '0' else floor1
+            self.Map = TileMap.TileMap.from_strings(self.Map, palette)
 
-        def get_map(self):
+        def get_map(self, rng=random):
             return self.Map
 
     class Objects:
         def __init__(self):
             self.objects = []
 
-        def get_objects(self, _map):
+        def get_objects(self, _map, rng=random):
             return self.objects
 
 
@@ -261,118 +321,135 @@ class SpecialMap(MapFactory):
     yaml_tag = "!special_map"
 
     class Map:
-        def __init__(self):
-            self.Map = [[0 for _ in range(41)] for _ in range(41)]
-            for i in range(41):
-                for j in range(41):
-                    if i == 0 or j == 0 or i == 40 or j == 40:
-                        self.Map[j][i] = wall
-                    else:
-                        self.Map[j][i] = [floor1, floor2, floor3][random.randint(0, 2)]
-
-        def get_map(self):
-            return self.Map
+
+        def get_map(self, rng=random):
+            return TileMap.TileMap.random(
+                rng, 41, 41, [TileMap.FLOOR1, TileMap.FLOOR2, TileMap.FLOOR3],
+                palette)
 
     class Objects:
         def __init__(self, rat_count=0, knight_count=0):
             self.rat_count = rat_count
             self.knight_count = knight_count
-            self.objects = []
 
-        def get_objects(self, _map):
+        def get_objects(self, _map, rng=random):
+            cells = FreeCells(_map, rng)
+            objects = []
             # Add enemies based on counts
-            if self.rat_count > 0:
-                for i in range(self.rat_count):
-                    coord = (random.randint(1, 39), random.randint(1, 39))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39), random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39), random.randint(1, 39))
-                    
-                    if 'rat' in object_list_prob['enemies']:
-                        prop = object_list_prob['enemies']['rat']
-                        self.objects.append(Objects.Enemy(
-                            prop['sprite'], prop, prop['experience'], coord))
-
-            if self.knight_count > 0:
-                for i in range(self.knight_count):
-                    coord = (random.randint(1, 39), random.randint(1, 39))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39), random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39), random.randint(1, 39))
-                    
-                    if 'knight' in object_list_prob['enemies']:
-                        prop = object_list_prob['enemies']['knight']
-                        self.objects.append(Objects.Enemy(
-                            prop['sprite'], prop, prop['experience'], coord))
+            for name, count in (('rat', self.rat_count),
+                                ('knight', self.knight_count)):
+                if name in object_list_prob['enemies']:
+                    prop = object_list_prob['enemies'][name]
+                    for i in range(count):
+                        objects.append(Objects.Enemy(
+                            prop['sprite'], prop, prop['experience'], cells.take()))
 
             # Add some random objects
             for obj_name in object_list_prob['objects']:
                 prop = object_list_prob['objects'][obj_name]
-                for i in range(random.randint(0, 2)):
-                    coord = (random.randint(1, 39), random.randint(1, 39))
-                    intersect = True
-                    while intersect:
-                        intersect = False
-                        if _map[coord[1]][coord[0]] == wall:
-                            intersect = True
-                            coord = (random.randint(1, 39), random.randint(1, 39))
-                            continue
-                        for obj in self.objects:
-                            if coord == obj.position or coord == (1, 1):
-                                intersect = True
-                                coord = (random.randint(1, 39), random.randint(1, 39))
-
-                    self.objects.append(Objects.Ally(
-                        prop['sprite'], prop['action'], coord))
+                for i in range(rng.randint(0, 2)):
+                    objects.append(Objects.Ally(
+                        prop['sprite'], prop['action'], cells.take()))
+
+            return objects
+
+class OpenWorldMap(MapFactory):
+    yaml_tag = "!open_world"
+
+    @classmethod
+    def from_yaml(cls, loader, node):
+        data = loader.construct_mapping(node)
+        _map = cls.Map(data.get('width', 4096), data.get('height', 4096),
+                       data.get('chunk', 64), data.get('path'))
+        _obj = cls.Objects(data.get('rat', 0), data.get('knight', 0))
+        return {'map': _map, 'obj': _obj}
+
+    class Map:
+        def __init__(self, width=4096, height=4096, chunk_size=64, path=None):
+            self.width = width
+            self.height = height
+            self.chunk_size = chunk_size
+            # Каталог для memory-mapped файлов тайлов, по файлу на seed
+            self.path = path
+
+        def get_map(self, rng=random):
+            seed = rng.getrandbits(63)
+            path = None
+            if self.path is not None:
+                path = os.path.join(self.path, f"world-{seed}.tiles")
+            return TileMap.ChunkedMap(
+                self.width, self.height,
+                TileMap.RandomChunks(seed, [TileMap.WALL, TileMap.FLOOR1,
+                                            TileMap.FLOOR2, TileMap.FLOOR3,
+                                            TileMap.FLOOR1, TileMap.FLOOR2,
+                                            TileMap.FLOOR3, TileMap.FLOOR1,
+                                            TileMap.FLOOR2]),
+                palette, self.chunk_size, path=path)
+
+    class Objects:
+        def __init__(self, rat_count=0, knight_count=0):
+            self.rat_count = rat_count
+            self.knight_count = knight_count
+
+        def get_objects(self, _map, rng=random):
+            cells = SparseCells(_map, rng)
+            objects = []
+            for name, count in (('rat', self.rat_count),
+                                ('knight', self.knight_count)):
+                if name in object_list_prob['enemies']:
+                    prop = object_list_prob['enemies'][name]
+                    for i in range(count):
+                        objects.append(Objects.Enemy(
+                            prop['sprite'], prop, prop['experience'], cells.take()))
+
+            for obj_name in object_list_prob['objects']:
+                prop = object_list_prob['objects'][obj_name]
+                for i in range(rng.randint(prop['min-count'], prop['max-count'])):
+                    objects.append(Objects.Ally(
+                        prop['sprite'], prop['action'], cells.take()))
+
+            return objects
 
-            return self.objects
 
 wall = [0]
 floor1 = [0]
 floor2 = [0]
 floor3 = [0]
+# Спрайты по идентификаторам тайлов TileMap
+palette = [wall, floor1, floor2, floor3]
 
 
-def service_init(sprite_size, full=True):
-    global object_list_prob, level_list
+def service_init(sprite_size, full=True, headless=None):
+    global object_list_prob, level_list, HEADLESS, object_list_src
 
     global wall
     global floor1
     global floor2
     global floor3
 
-    wall[0] = create_sprite(os.path.join("texture", "wall.png"), sprite_size)
-    floor1[0] = create_sprite(os.path.join("texture", "Ground_1.png"), sprite_size)
-    floor2[0] = create_sprite(os.path.join("texture", "Ground_2.png"), sprite_size)
-    floor3[0] = create_sprite(os.path.join("texture", "Ground_3.png"), sprite_size)
+    if headless is not None:
+        HEADLESS = headless
 
-    file = open("objects.yml", "r")
+    wall[0] = create_sprite(os.path.join(TEXTURE, "wall.png"), sprite_size)
+    floor1[0] = create_sprite(os.path.join(TEXTURE, "Ground_1.png"), sprite_size)
+    floor2[0] = create_sprite(os.path.join(TEXTURE, "Ground_2.png"), sprite_size)
+    floor3[0] = create_sprite(os.path.join(TEXTURE, "Ground_3.png"), sprite_size)
 
-    object_list_tmp = yaml.load(file.read())
+    # objects.yml разбирается один раз, зум только подменяет спрайты
+    if object_list_src is None:
+        file = open(os.path.join(BASE_DIR, "objects.yml"), "r")
+        object_list_src = yaml.load(file.read(), Loader=yaml.Loader)
+        file.close()
+    object_list_tmp = object_list_src
     if full:
-        object_list_prob = object_list_tmp
+        object_list_prob = copy.deepcopy(object_list_src)
 
     object_list_actions = {'reload_game': reload_game,
                            'add_gold': add_gold,
                            'apply_blessing': apply_blessing,
                            'remove_effect': remove_effect,
-                           'restore_hp': restore_hp}
+                           'restore_hp': restore_hp,
+                           'apply_power': apply_power}
 
     for obj in object_list_prob['objects']:
         prop = object_list_prob['objects'][obj]
@@ -394,10 +471,8 @@ def service_init(sprite_size, full=True):
         prop['sprite'][0] = create_sprite(
             os.path.join(ENEMY_TEXTURE, prop_tmp['sprite'][0]), sprite_size)
 
-    file.close()
-
     if full:
-        file = open("levels.yml", "r")
-        level_list = yaml.load(file.read())['levels']
+        file = open(os.path.join(BASE_DIR, "levels.yml"), "r")
+        level_list = yaml.load(file.read(), Loader=yaml.Loader)['levels']
         level_list.append({'map': EndMap.Map(), 'obj': EndMap.Objects()})
         file.close()
@@ -0,0 +1,61 @@
+import os
+import time
+import Objects
+import Logic
+import Service
+
+# Порядок действий совпадает с RL-веткой Main.py
+ACTIONS = ("move_right", "move_left", "move_up", "move_down")
+
+base_stats = {
+    "strength": 20,
+    "endurance": 20,
+    "intelligence": 5,
+    "luck": 5
+}
+
+
+def create_engine(seed=None):
+    """Создаёт движок без окна: спрайты заменены заглушками, цепочки
+    ScreenEngine нет. Уровни строятся по требованию из seed."""
+    if not Service.HEADLESS:
+        Service.service_init(0, headless=True)
+    hero = Objects.Hero(base_stats.copy(), Service.create_sprite(
+        os.path.join(Service.TEXTURE, "Hero.png"), 0))
+    engine = Logic.GameEngine(seed)
+    engine.levels = Service.LevelPipeline(engine.random.seed, prefetch=False)
+    Service.reload_game(engine, hero)
+    return engine
+
+
+def is_finished(engine):
+    return engine.level >= len(Service.level_list) - 1
+
+
+def run_episode(policy, max_steps=1000, seed=None):
+    """Играет один эпизод без отрисовки.
+
+    policy(engine) возвращает индекс действия из ACTIONS. Эпизод
+    заканчивается на последнем уровне или через max_steps шагов.
+    """
+    engine = create_engine(seed)
+    actions = [getattr(engine, name) for name in ACTIONS]
+    steps = 0
+    start = time.perf_counter()
+    while steps < max_steps and engine.working and not is_finished(engine):
+        actions[policy(engine)]()
+        engine.events.dispatch()
+        steps += 1
+    elapsed = time.perf_counter() - start
+    hero = engine.hero
+    return {
+        "score": engine.score,
+        "steps": steps,
+        "floor": engine.level,
+        "finished": is_finished(engine),
+        "hero_level": hero.level,
+        "exp": hero.exp,
+        "gold": hero.gold,
+        "hp": hero.hp,
+        "steps_per_second": steps / elapsed if elapsed else 0.,
+    }
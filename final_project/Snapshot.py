@@ -0,0 +1,134 @@
+import marshal
+import os
+import numpy as np
+import Objects
+import Randomness
+import Service
+import TileMap
+
+VERSION = 6
+
+KINDS = ("objects", "ally", "enemies")
+
+
+def object_keys():
+    """Соответствие списка-спрайта объекта его записи в objects.yml.
+
+    У каждой записи свой список спрайта, поэтому по нему объект
+    восстанавливается вместе с действием и характеристиками по ссылке.
+    """
+    keys = {}
+    for kind in KINDS:
+        for name, prop in Service.object_list_prob[kind].items():
+            keys[id(prop['sprite'])] = (kind, name)
+    return keys
+
+
+def save_hero(hero):
+    # Эффекты без состояния, от них достаточно имён классов
+    effects = tuple(type(effect).__name__ for effect in hero.effects)
+    state = {name: value for name, value in vars(hero).items()
+             if name not in ("sprite", "effects", "_stats")}
+    return state, effects
+
+
+def save_map(game_map):
+    if isinstance(game_map, TileMap.ChunkedMap):
+        generate = game_map.generate
+        store = game_map.store.filename if game_map.store is not None else None
+        return ("chunked", game_map.width, game_map.height,
+                game_map.chunk_size, game_map.keep_radius, generate.seed,
+                generate.choices.tobytes(), tuple(generate.start), store)
+    return ("tiles", game_map.width, game_map.height, game_map.tiles.tobytes())
+
+
+def save(engine):
+    """Снимок состояния игры в компактном бинарном виде (marshal).
+
+    Спрайты не сохраняются: объекты ссылаются на записи objects.yml,
+    а спрайт героя берётся у движка, в который снимок восстанавливается.
+    """
+    keys = object_keys()
+    table = []
+    codes = []
+    xs = []
+    ys = []
+    for obj in engine.objects:
+        key = keys[id(obj.sprite)]
+        if key not in table:
+            table.append(key)
+        codes.append(table.index(key))
+        xs.append(obj.position[0])
+        ys.append(obj.position[1])
+    seed = engine.levels.seed if engine.levels is not None else None
+    rng = (engine.random.seed, engine.random.getstate())
+    return marshal.dumps((VERSION, engine.level, engine.score, engine.step,
+                          seed, rng,
+                          save_hero(engine.hero), save_map(engine.map),
+                          engine.fov.save(),
+                          tuple(table), tuple(codes), tuple(xs), tuple(ys)))
+
+
+def load_hero(state, effects, sprite):
+    hero = Objects.Hero.__new__(Objects.Hero)
+    vars(hero).update(state)
+    hero.sprite = sprite
+    # Стек собирается без add_effect, чтобы не менять здоровье
+    hero.effects = [getattr(Objects, name)() for name in effects]
+    hero._stats = None
+    return hero
+
+
+def load_map(state):
+    if state[0] == "chunked":
+        (_, width, height, chunk_size, keep_radius, seed, choices, start,
+         store) = state
+        generate = TileMap.RandomChunks(
+            seed, np.frombuffer(choices, dtype=np.uint8), start)
+        return TileMap.ChunkedMap(width, height, generate, Service.palette,
+                                  chunk_size, keep_radius, store)
+    _, width, height, tiles = state
+    tiles = np.frombuffer(tiles, dtype=np.uint8).reshape(height, width)
+    return TileMap.TileMap(tiles, Service.palette)
+
+
+def restore(engine, data, hero_sprite=None):
+    """Восстанавливает снимок save() в движок engine."""
+    data = marshal.loads(data)
+    if data[0] != VERSION:
+        raise ValueError(f"Unsupported snapshot version: {data[0]}")
+    (version, level, score, step, seed, rng, hero, game_map, explored,
+     table, codes, xs, ys) = data
+
+    if hero_sprite is None:
+        if engine.hero is not None:
+            hero_sprite = engine.hero.sprite
+        else:
+            hero_sprite = Service.create_sprite(
+                os.path.join(Service.TEXTURE, "Hero.png"),
+                getattr(engine, "sprite_size", 0))
+
+    engine.clear_objects()
+    engine.level = level
+    engine.score = score
+    engine.step = step
+    engine.random = Randomness.RandomStreams(rng[0])
+    engine.random.setstate(rng[1])
+    if seed is not None:
+        prefetch = engine.levels.prefetch_enabled if engine.levels else True
+        engine.levels = Service.LevelPipeline(seed, prefetch)
+    engine.load_map(load_map(game_map))
+    engine.fov.load(explored)
+
+    objects = []
+    for code, x, y in zip(codes, xs, ys):
+        kind, name = table[code]
+        prop = Service.object_list_prob[kind][name]
+        if kind == "enemies":
+            objects.append(Objects.Enemy(prop['sprite'], prop,
+                                         prop['experience'], (x, y)))
+        else:
+            objects.append(Objects.Ally(prop['sprite'], prop['action'], (x, y)))
+    engine.add_objects(objects)
+    engine.add_hero(load_hero(*hero, hero_sprite))
+    return engine
@@ -0,0 +1,75 @@
+import collections
+# Без pygame доступен только режим без окна (Service.HEADLESS)
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+
+class TextureManager:
+    """Атлас текстур и кэш спрайтов по размерам.
+
+    Каждый PNG декодируется один раз и укладывается на полку общего
+    атласа. Спрайты нужного размера масштабируются из атласа и
+    хранятся по размеру; редко используемые размеры вытесняются (LRU).
+    """
+
+    atlas_width = 512
+
+    def __init__(self, max_sizes=8):
+        self.max_sizes = max_sizes
+        self.atlas = None
+        self.rects = {}
+        # x, y и высота текущей полки атласа
+        self.shelf = (0, 0, 0)
+        self.sizes = collections.OrderedDict()
+
+    def load(self, path):
+        if path not in self.rects:
+            image = pygame.image.load(path)
+            if pygame.display.get_surface() is not None:
+                image = image.convert_alpha()
+            self.rects[path] = self.place(image)
+        return self.rects[path]
+
+    def place(self, image):
+        width, height = image.get_size()
+        x, y, shelf_height = self.shelf
+        if x + width > self.atlas_width:
+            x, y, shelf_height = 0, y + shelf_height, 0
+        shelf_height = max(shelf_height, height)
+        if self.atlas is None or y + shelf_height > self.atlas.get_height():
+            self.grow(y + shelf_height)
+        # Сложение с прозрачным фоном копирует пиксели без смешивания
+        self.atlas.blit(image, (x, y), special_flags=pygame.BLEND_RGBA_ADD)
+        self.shelf = (x + width, y, shelf_height)
+        return pygame.Rect(x, y, width, height)
+
+    def grow(self, height):
+        old = self.atlas
+        if old is not None:
+            height = max(height, 2 * old.get_height())
+        self.atlas = pygame.Surface((self.atlas_width, height), pygame.SRCALPHA)
+        self.atlas.fill((0, 0, 0, 0))
+        if old is not None:
+            self.atlas.blit(old, (0, 0), special_flags=pygame.BLEND_RGBA_ADD)
+
+    def sprite(self, path, sprite_size):
+        sprites = self.sizes.get(sprite_size)
+        if sprites is None:
+            sprites = self.sizes[sprite_size] = {}
+            if len(self.sizes) > self.max_sizes:
+                self.sizes.popitem(last=False)
+        else:
+            self.sizes.move_to_end(sprite_size)
+        if path not in sprites:
+            icon = self.atlas_image(path)
+            icon = pygame.transform.scale(icon, (sprite_size, sprite_size))
+            sprite = pygame.Surface((sprite_size, sprite_size), pygame.HWSURFACE)
+            sprite.blit(icon, (0, 0))
+            sprites[path] = sprite
+        return sprites[path]
+
+    def atlas_image(self, path):
+        rect = self.load(path)
+        return self.atlas.subsurface(rect)
@@ -0,0 +1,283 @@
+import os
+import numpy as np
+
+# Идентификаторы тайлов
+WALL = 0
+FLOOR1 = 1
+FLOOR2 = 2
+FLOOR3 = 3
+
+
+class TileMap:
+    """Карта уровня: массив uint8 идентификаторов тайлов и палитра.
+
+    palette[tile_id] - список из одного спрайта, как Service.wall, так что
+    зум подменяет спрайты, не трогая карту.
+    """
+
+    def __init__(self, tiles, palette):
+        self.tiles = np.ascontiguousarray(tiles, dtype=np.uint8)
+        self.palette = palette
+        # Связная область пола вокруг клетки, см. start_region
+        self.start_cache = None
+
+    @classmethod
+    def from_strings(cls, rows, palette, wall_char='0', floor=FLOOR1):
+        tiles = np.array([[WALL if c == wall_char else floor for c in row]
+                          for row in rows], dtype=np.uint8)
+        return cls(tiles, palette)
+
+    @classmethod
+    def random(cls, rng, width, height, choices, palette, start=(1, 1)):
+        """Случайная карта с рамкой из стен; rng - random.Random уровня.
+
+        Клетка start, где появляется герой, всегда пол.
+        """
+        generator = np.random.default_rng(rng.getrandbits(64))
+        choices = np.asarray(choices, dtype=np.uint8)
+        tiles = choices[generator.integers(0, len(choices), (height, width))]
+        tiles[0, :] = tiles[-1, :] = WALL
+        tiles[:, 0] = tiles[:, -1] = WALL
+        if tiles[start[1], start[0]] == WALL:
+            tiles[start[1], start[0]] = FLOOR1
+        return cls(tiles, palette)
+
+    @property
+    def width(self):
+        return self.tiles.shape[1]
+
+    @property
+    def height(self):
+        return self.tiles.shape[0]
+
+    def is_wall(self, x, y):
+        return self.tiles[y, x] == WALL
+
+    def sprite(self, x, y):
+        return self.palette[self.tiles[y, x]][0]
+
+    def region(self, x0, y0, x1, y1):
+        """Тайлы прямоугольника [x0, x1) x [y0, y1); за краем карты - стены."""
+        out = np.full((y1 - y0, x1 - x0), WALL, dtype=np.uint8)
+        cx0, cy0 = max(x0, 0), max(y0, 0)
+        cx1, cy1 = min(x1, self.width), min(y1, self.height)
+        if cx0 < cx1 and cy0 < cy1:
+            out[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0] = \
+                self.tiles[cy0:cy1, cx0:cx1]
+        return out
+
+    def focus(self, x, y):
+        pass
+
+    def start_region(self, start):
+        """Маска связной области пола, где лежит start.
+
+        Маска запоминается, так что проверка карты генератором и
+        расстановка объектов размечают области один раз.
+        """
+        start = tuple(start)
+        if self.start_cache is None or self.start_cache[0] != start:
+            labels = label_regions(self.tiles != WALL)
+            label = labels[start[1], start[0]]
+            self.start_cache = (start, labels == label if label >= 0
+                                else np.zeros(labels.shape, dtype=bool))
+        return self.start_cache[1]
+
+    def connect(self, start):
+        """Прорубает коридор от start к самой большой области пола.
+
+        Коридор идёт по строке start, затем по столбцу до ближайшей к
+        start клетки этой области.
+        """
+        labels = label_regions(self.tiles != WALL)
+        counts = np.bincount(labels[labels >= 0])
+        if not len(counts):
+            return
+        ys, xs = np.nonzero(labels == counts.argmax())
+        x, y = start
+        nearest = np.argmin(np.abs(xs - x) + np.abs(ys - y))
+        tx, ty = int(xs[nearest]), int(ys[nearest])
+        row = self.tiles[y, min(x, tx):max(x, tx) + 1]
+        row[row == WALL] = FLOOR1
+        column = self.tiles[min(y, ty):max(y, ty) + 1, tx]
+        column[column == WALL] = FLOOR1
+        self.start_cache = None
+
+    def floor_cells(self, start=None):
+        """Клетки пола; со start - только связная область, где лежит start."""
+        floor = self.tiles != WALL if start is None \
+            else self.start_region(start)
+        ys, xs = np.nonzero(floor)
+        return list(zip(xs.tolist(), ys.tolist()))
+
+
+def label_regions(floor):
+    """Метки связных (по четырём сторонам) областей маски floor, -1 вне её.
+
+    Каждая строка режется на отрезки пола, отрезки соседних строк,
+    перекрывающиеся по x, объединяются. Объединение - система
+    непересекающихся множеств на массивах: корни подвешиваются к
+    меньшему корню и пути сжимаются удвоением, пока все пары отрезков
+    не окажутся в одном множестве. Весь проход - несколько линейных
+    операций NumPy над клетками и отрезками.
+    """
+    height, width = floor.shape
+    # Столбец стен справа, чтобы отрезки не переходили на следующую строку
+    padded = np.zeros((height, width + 1), dtype=bool)
+    padded[:, :width] = floor
+    flat = padded.ravel()
+    starts = flat.copy()
+    starts[1:] &= ~flat[:-1]
+    runs = np.cumsum(starts) - 1
+    runs = np.where(flat, runs, -1).reshape(height, width + 1)[:, :width]
+    count = int(runs.max()) + 1 if runs.size else 0
+
+    # Пары отрезков, соприкасающихся между строками y и y + 1; в порядке
+    # обхода повторы идут подряд
+    touching = floor[:-1] & floor[1:]
+    upper = runs[:-1][touching]
+    lower = runs[1:][touching]
+    if len(upper):
+        keep = np.ones(len(upper), dtype=bool)
+        keep[1:] = (upper[1:] != upper[:-1]) | (lower[1:] != lower[:-1])
+        upper, lower = upper[keep], lower[keep]
+
+    parent = np.arange(count)
+    while True:
+        root_upper, root_lower = parent[upper], parent[lower]
+        differ = root_upper != root_lower
+        if not differ.any():
+            break
+        root_upper, root_lower = root_upper[differ], root_lower[differ]
+        np.minimum.at(parent, np.maximum(root_upper, root_lower),
+                      np.minimum(root_upper, root_lower))
+        while True:
+            grand = parent[parent]
+            if (grand == parent).all():
+                break
+            parent = grand
+
+    labels = np.full(floor.shape, -1, dtype=np.int64)
+    labels[floor] = parent[runs[floor]]
+    return labels
+
+
+class RandomChunks:
+    """Генератор чанков: тайлы зависят только от seed и координат чанка,
+    поэтому выгруженный чанк восстанавливается без сохранения."""
+
+    def __init__(self, seed, choices, start=(1, 1)):
+        self.seed = seed
+        self.choices = np.asarray(choices, dtype=np.uint8)
+        self.start = start
+
+    def __call__(self, cx, cy, shape, chunk_size):
+        generator = np.random.default_rng([self.seed, cx, cy])
+        tiles = self.choices[generator.integers(0, len(self.choices), shape)]
+        x, y = self.start
+        if (cx, cy) == (x // chunk_size, y // chunk_size):
+            tiles[y % chunk_size, x % chunk_size] = FLOOR1
+        return tiles
+
+
+class ChunkedMap:
+    """Большая карта из квадратных чанков, которые строятся по требованию.
+
+    В памяти держатся только чанки рядом с героем (см. focus), дальние
+    выгружаются. С path тайлы сохраняются в memory-mapped файл и при
+    повторном обращении читаются с диска, а не генерируются.
+    Интерфейс совпадает с TileMap, кроме tiles и работы со связными
+    областями (floor_cells, start_region, connect).
+    """
+
+    def __init__(self, width, height, generate, palette, chunk_size=64,
+                 keep_radius=2, path=None):
+        self.width = width
+        self.height = height
+        self.generate = generate
+        self.palette = palette
+        self.chunk_size = chunk_size
+        self.keep_radius = keep_radius
+        self.chunks = {}
+        self.focus_chunk = None
+        self.store = None
+        if path is not None:
+            mode = "r+" if os.path.exists(path) else "w+"
+            grid = (-(-height // chunk_size), -(-width // chunk_size))
+            self.store = np.memmap(path, np.uint8, mode, shape=(height, width))
+            self.generated = np.memmap(path + ".chunks", np.uint8, mode,
+                                       shape=grid)
+
+    def chunk(self, cx, cy):
+        tiles = self.chunks.get((cx, cy))
+        if tiles is None:
+            tiles = self.chunks[(cx, cy)] = self.load_chunk(cx, cy)
+        return tiles
+
+    def load_chunk(self, cx, cy):
+        size = self.chunk_size
+        ys = slice(cy * size, min((cy + 1) * size, self.height))
+        xs = slice(cx * size, min((cx + 1) * size, self.width))
+        if self.store is not None and self.generated[cy, cx]:
+            return np.array(self.store[ys, xs])
+        tiles = self.generate(cx, cy, (ys.stop - ys.start, xs.stop - xs.start),
+                              size)
+        # Рамка из стен по краю мира
+        if ys.start == 0:
+            tiles[0, :] = WALL
+        if xs.start == 0:
+            tiles[:, 0] = WALL
+        if ys.stop == self.height:
+            tiles[-1, :] = WALL
+        if xs.stop == self.width:
+            tiles[:, -1] = WALL
+        if self.store is not None:
+            self.store[ys, xs] = tiles
+            self.generated[cy, cx] = 1
+        return tiles
+
+    def is_wall(self, x, y):
+        size = self.chunk_size
+        return self.chunk(x // size, y // size)[y % size, x % size] == WALL
+
+    def sprite(self, x, y):
+        size = self.chunk_size
+        return self.palette[self.chunk(x // size, y // size)[y % size, x % size]][0]
+
+    def region(self, x0, y0, x1, y1):
+        out = np.full((y1 - y0, x1 - x0), WALL, dtype=np.uint8)
+        size = self.chunk_size
+        cx0, cy0 = max(x0, 0), max(y0, 0)
+        cx1, cy1 = min(x1, self.width), min(y1, self.height)
+        if cx0 >= cx1 or cy0 >= cy1:
+            return out
+        for cy in range(cy0 // size, (cy1 - 1) // size + 1):
+            for cx in range(cx0 // size, (cx1 - 1) // size + 1):
+                tiles = self.chunk(cx, cy)
+                ax0, ay0 = max(cx0, cx * size), max(cy0, cy * size)
+                ax1 = min(cx1, cx * size + tiles.shape[1])
+                ay1 = min(cy1, cy * size + tiles.shape[0])
+                out[ay0 - y0:ay1 - y0, ax0 - x0:ax1 - x0] = \
+                    tiles[ay0 - cy * size:ay1 - cy * size,
+                          ax0 - cx * size:ax1 - cx * size]
+        return out
+
+    def focus(self, x, y):
+        """Подгружает чанки вокруг героя и выгружает дальние."""
+        size = self.chunk_size
+        cx, cy = x // size, y // size
+        if (cx, cy) == self.focus_chunk:
+            return
+        self.focus_chunk = (cx, cy)
+        far = [key for key in self.chunks
+               if max(abs(key[0] - cx), abs(key[1] - cy)) > self.keep_radius]
+        for key in far:
+            del self.chunks[key]
+        for ny in range(max(0, cy - 1), min(cy + 2, -(-self.height // size))):
+            for nx in range(max(0, cx - 1), min(cx + 2, -(-self.width // size))):
+                self.chunk(nx, ny)
+
+    def flush(self):
+        if self.store is not None:
+            self.store.flush()
+            self.generated.flush()
@@ -0,0 +1,199 @@
+import numpy as np
+import TileMap
+
+# Множители координат для восьми октантов обзора
+OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+           (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+
+def shadowcast(walls, radius):
+    """Видимые клетки окна walls (2 * radius + 1) с наблюдателем в центре.
+
+    Рекурсивное отбрасывание теней: каждый октант обходится по рядам от
+    наблюдателя, стены сужают диапазон наклонов, в котором свет идёт
+    дальше.
+    """
+    size = 2 * radius + 1
+    walls = walls.tolist()
+    visible = [[False] * size for _ in range(size)]
+    visible[radius][radius] = True
+    limit = radius * radius + radius
+
+    def cast(row, start, end, xx, xy, yx, yy):
+        if start < end:
+            return
+        new_start = start
+        for j in range(row, radius + 1):
+            dx, dy = -j - 1, -j
+            blocked = False
+            while dx <= 0:
+                dx += 1
+                left, right = (dx - 0.5) / (dy + 0.5), (dx + 0.5) / (dy - 0.5)
+                if start < right:
+                    continue
+                if end > left:
+                    break
+                x = radius + dx * xx + dy * xy
+                y = radius + dx * yx + dy * yy
+                if dx * dx + dy * dy <= limit:
+                    visible[y][x] = True
+                if blocked:
+                    if walls[y][x]:
+                        new_start = right
+                    else:
+                        blocked = False
+                        start = new_start
+                elif walls[y][x] and j < radius:
+                    blocked = True
+                    cast(j + 1, start, left, xx, xy, yx, yy)
+                    new_start = right
+            if blocked:
+                break
+
+    for octant in OCTANTS:
+        cast(1, 1.0, 0.0, *octant)
+    return np.array(visible, dtype=bool)
+
+
+class ExploredCells:
+    """Битовая маска исследованных клеток уровня, бит на клетку.
+
+    Биты хранятся по чанкам chunk x chunk клеток, и в памяти есть только
+    чанки, где что-то исследовано: на больших картах из чанков это малая
+    часть уровня, и снимок сохраняет только их.
+    """
+
+    chunk = 64
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.chunks = {}
+
+    def parts(self, x0, y0, x1, y1):
+        """Куски [x0, x1) x [y0, y1) внутри карты по чанкам.
+
+        Каждый кусок - (чанк, x0, y0, x1, y1) в координатах карты.
+        """
+        size = self.chunk
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.width), min(y1, self.height)
+        for cy in range(y0 // size, (y1 - 1) // size + 1 if y0 < y1 else 0):
+            for cx in range(x0 // size, (x1 - 1) // size + 1 if x0 < x1 else 0):
+                yield ((cx, cy), max(x0, cx * size), max(y0, cy * size),
+                       min(x1, (cx + 1) * size), min(y1, (cy + 1) * size))
+
+    def mark(self, x0, y0, mask):
+        """Отмечает клетки mask с левым верхним углом (x0, y0).
+
+        Возвращает True, если среди них были новые.
+        """
+        height, width = mask.shape
+        size = self.chunk
+        changed = False
+        for key, ax0, ay0, ax1, ay1 in self.parts(x0, y0, x0 + width,
+                                                  y0 + height):
+            part = mask[ay0 - y0:ay1 - y0, ax0 - x0:ax1 - x0]
+            if not part.any():
+                continue
+            bits = self.chunks.get(key)
+            if bits is None:
+                bits = self.chunks[key] = np.zeros((size, size // 8),
+                                                   dtype=np.uint8)
+            lx0, ly0 = ax0 - key[0] * size, ay0 - key[1] * size
+            rows = np.unpackbits(bits[ly0:ly0 + ay1 - ay0], axis=1)
+            window = rows[:, lx0:lx0 + ax1 - ax0]
+            if not (part & ~window.astype(bool)).any():
+                continue
+            window |= part
+            bits[ly0:ly0 + ay1 - ay0] = np.packbits(rows, axis=1)
+            changed = True
+        return changed
+
+    def region(self, x0, y0, x1, y1):
+        """Маска клеток [x0, x1) x [y0, y1), за краем карты - False."""
+        result = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        size = self.chunk
+        for key, ax0, ay0, ax1, ay1 in self.parts(x0, y0, x1, y1):
+            bits = self.chunks.get(key)
+            if bits is None:
+                continue
+            lx0, ly0 = ax0 - key[0] * size, ay0 - key[1] * size
+            rows = np.unpackbits(bits[ly0:ly0 + ay1 - ay0], axis=1)
+            result[ay0 - y0:ay1 - y0, ax0 - x0:ax1 - x0] = \
+                rows[:, lx0:lx0 + ax1 - ax0]
+        return result
+
+    def dumps(self):
+        return tuple((cx, cy, bits.tobytes())
+                     for (cx, cy), bits in self.chunks.items())
+
+    def loads(self, data):
+        size = self.chunk
+        self.chunks = {(cx, cy): np.frombuffer(bits, dtype=np.uint8).reshape(
+            size, size // 8).copy() for cx, cy, bits in data}
+
+
+class FieldOfView:
+    """Поле зрения героя и исследованные клетки уровня.
+
+    Обзор пересчитывается, только когда герой сменил клетку или стены
+    изменились (invalidate()). Пока tracking выключен (движок без
+    отрисовки), обзор не считается.
+    """
+
+    radius = 8
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.tracking = False
+        self.map = None
+        self.key = None
+        self.explored = None
+        # Растёт при каждом открытии новых клеток
+        self.version = 0
+
+    def invalidate(self):
+        self.key = None
+
+    def reset(self):
+        game_map = self.engine.map
+        self.map = game_map
+        self.explored = ExploredCells(game_map.width, game_map.height)
+        self.key = None
+        self.version += 1
+
+    def update(self):
+        engine = self.engine
+        if engine.map is None or engine.hero is None:
+            return
+        if self.map is not engine.map:
+            self.reset()
+        x, y = engine.hero.position
+        key = (x, y)
+        if key == self.key:
+            return
+        self.key = key
+        r = self.radius
+        self.origin = (x - r, y - r)
+        walls = engine.map.region(x - r, y - r, x + r + 1, y + r + 1) == \
+            TileMap.WALL
+        self.visible = shadowcast(walls, r)
+        if self.explored.mark(x - r, y - r, self.visible):
+            self.version += 1
+
+    def is_visible(self, x, y):
+        x -= self.origin[0]
+        y -= self.origin[1]
+        size = 2 * self.radius + 1
+        return 0 <= x < size and 0 <= y < size and self.visible[y, x]
+
+    def save(self):
+        if self.explored is None or self.map is not self.engine.map:
+            return None
+        return self.explored.dumps()
+
+    def load(self, data):
+        self.reset()
+        if data is not None:
+            self.explored.loads(data)
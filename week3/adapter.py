@@ -1,20 +1,35 @@
+import numpy as np
+
+
 class MappingAdapter:
-    def __init__(self, adaptee):
+    # Сколько изменённых клеток пересчитывается по отдельности
+    max_regions = 16
+
+    def __init__(self, adaptee, radius=None):
         # adaptee - это объект класса Light
         self.adaptee = adaptee
-    
+        # Радиус действия света. Если он задан, карты NumPy освещаются
+        # инкрементально: пересчитывается только область вокруг клеток,
+        # изменившихся с прошлого вызова
+        self.radius = radius
+        self.grid = None
+        self.lighting = None
+
     def lighten(self, grid):
+        if isinstance(grid, np.ndarray):
+            return self.lighten_array(grid)
+
         # Определяем размеры карты (высота, ширина)
         height = len(grid)
         width = len(grid[0]) if height > 0 else 0
-        
+
         # Устанавливаем размеры в адаптируемом объекте
         self.adaptee.set_dim((width, height))
-        
+
         # Собираем координаты источников света и препятствий
         lights = []
         obstacles = []
-        
+
         # Проходим по всем клеткам карты
         for y in range(height):
             for x in range(width):
@@ -22,10 +37,57 @@ class MappingAdapter:
                     lights.append((x, y))
                 elif grid[y][x] == -1:  # Препятствие
                     obstacles.append((x, y))
-        
+
         # Устанавливаем источники света и препятствия
         self.adaptee.set_lights(lights)
         self.adaptee.set_obstacles(obstacles)
-        
+
         # Возвращаем освещенную карту
         return self.adaptee.generate_lights()
+
+    def relight(self, grid):
+        # Координаты источников и препятствий собираются без цикла по
+        # клеткам; np.nonzero возвращает (y, x), адаптируемый объект ждёт (x, y)
+        height, width = grid.shape
+        self.adaptee.set_dim((width, height))
+        ys, xs = np.nonzero(grid == 1)
+        self.adaptee.set_lights(list(zip(xs.tolist(), ys.tolist())))
+        ys, xs = np.nonzero(grid == -1)
+        self.adaptee.set_obstacles(list(zip(xs.tolist(), ys.tolist())))
+        return np.array(self.adaptee.generate_lights())
+
+    def lighten_array(self, grid):
+        """Освещение карты - массива NumPy, результат тоже массив."""
+        if self.radius is None or self.grid is None or \
+                self.grid.shape != grid.shape:
+            self.lighting = self.relight(grid)
+            self.grid = grid.copy()
+            return self.lighting.copy()
+
+        ys, xs = np.nonzero(grid != self.grid)
+        if not len(ys):
+            return self.lighting.copy()
+
+        # Немногие изменения пересчитываются каждое в своём окне, иначе
+        # одним окном вокруг всех изменений
+        if len(ys) > self.max_regions:
+            regions = [(xs.min(), xs.max(), ys.min(), ys.max())]
+        else:
+            regions = zip(xs.tolist(), xs.tolist(), ys.tolist(), ys.tolist())
+        for region in regions:
+            self.relight_region(grid, *region)
+        return self.lighting.copy()
+
+    def relight_region(self, grid, x_min, x_max, y_min, y_max):
+        # Изменения влияют на освещение клеток в пределах radius, а
+        # освещение этих клеток зависит от клеток ещё в пределах radius,
+        # поэтому адаптируемому объекту передаётся окно вдвое шире
+        height, width = grid.shape
+        r = self.radius
+        x0, x1 = max(0, x_min - r), min(width, x_max + r + 1)
+        y0, y1 = max(0, y_min - r), min(height, y_max + r + 1)
+        ox0, ox1 = max(0, x0 - r), min(width, x1 + r)
+        oy0, oy1 = max(0, y0 - r), min(height, y1 + r)
+        part = self.relight(grid[oy0:oy1, ox0:ox1])
+        self.lighting[y0:y1, x0:x1] = part[y0 - oy0:y1 - oy0, x0 - ox0:x1 - ox0]
+        self.grid[y0:y1, x0:x1] = grid[y0:y1, x0:x1]